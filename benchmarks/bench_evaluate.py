@@ -0,0 +1,40 @@
+#!/usr/bin/env python3.11
+"""Measures the per-dispatch overhead of IsolatedEnvironment.evaluate().
+
+Compares evaluating the raw expression string, which reparses and
+recompiles it on every call, against evaluating the cached code object.
+
+Usage: PYTHONPATH=flaskr python benchmarks/bench_evaluate.py [iterations]
+"""
+
+import sys
+import timeit
+
+from qseq.sequencer import IsolatedEnvironment
+
+
+def main():
+    if len(sys.argv) > 1:
+        number = int(sys.argv[1])
+    else:
+        number = 200000
+
+    env = IsolatedEnvironment()
+    env.inject_global('timestamp', lambda: None)
+    expression = 'timestamp()'
+
+    def uncached():
+        eval(expression, env.globals, env.globals)
+
+    env.compile(expression)
+
+    def cached():
+        env.evaluate(expression)
+
+    for name, func in (('uncached', uncached), ('cached', cached)):
+        t = min(timeit.repeat(func, number=number, repeat=5))
+        print('%-10s %8.1f ns/dispatch' % (name, t / number * 1e9))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3.11
+"""Benchmark suite for the sequencer.
+
+Generates synthetic sequence files of increasing size, with many single
+steps, a high-rate periodic step and nested repeat blocks, and measures:
+
+ - parser: SequenceFileParser throughput in lines per second
+ - build: time and peak memory of Sequencer._parse_input_lines() and of
+   building the schedule list
+ - dispatch: per step overhead of Sequencer._eval_steps() on a virtual
+   clock, that is without waiting
+ - csvlog: CsvLog and BufferedCsvLog rows per second
+ - datacache: DataCacheThread.get_data() latency with and without copying
+
+The results are written as JSON, so runs of different versions can be
+compared.
+
+Usage: PYTHONPATH=flaskr python benchmarks/bench_qseq.py [options]
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import tempfile
+import tracemalloc
+from optparse import OptionParser
+
+from qseq import __version__
+from qseq.sequencer import Sequencer, SequenceFileParser
+from qseq.timing import LatencyHistogram, VirtualTimer
+from qseq.dispatch import InlineDispatcher
+from qseq.csvlog import CsvLog, BufferedCsvLog
+from qseq.datacache import DataCacheThread
+
+DEFAULT_SIZES = '1000,10000,100000'
+
+
+def generate_sequence(filename, steps):
+    """Writes a sequence with the given number of single steps, a periodic
+    step every 10 ms and a nested repeat block every 1000 steps."""
+    with open(filename, 'w') as f:
+        f.write('i noop()\n')
+        f.write('p 0.01 noop()\n')
+        f.write('P 1 0.5 noop()\n')
+        for i in range(steps):
+            f.write('s 0.001 noop()\n')
+            if i % 1000 == 999:
+                f.write('r 3\n'
+                        ' s 0.01 noop()\n'
+                        ' r 2\n'
+                        '  s 0.005 noop()\n'
+                        '  p 0.002 noop()\n'
+                        ' R\n'
+                        'R\n')
+        f.write('f noop()\n')
+
+
+def noop():
+    pass
+
+
+def best_of(func, repeat):
+    """Returns the shortest of repeat calls of func in seconds."""
+    times = list()
+    for i in range(repeat):
+        begin = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - begin)
+    return min(times)
+
+
+def bench_parser(filename, repeat):
+    with open(filename) as f:
+        count = sum(1 for line in f)
+    t = best_of(lambda: SequenceFileParser(filename), repeat)
+    return dict(lines=count, seconds=t, lines_per_second=count / t)
+
+
+def bench_build(filename, repeat):
+    lines = SequenceFileParser(filename).lines
+
+    def build():
+        s = Sequencer()
+        s._parse_input_lines(lines)
+        # the schedule list is built on first access
+        len(s.schedule)
+        return s
+
+    t = best_of(build, repeat)
+
+    tracemalloc.start()
+    s = build()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return dict(lines=len(lines), steps=len(s.schedule), seconds=t,
+                steps_per_second=len(s.schedule) / t, peak_memory=peak)
+
+
+def bench_dispatch(filename, repeat):
+    def run():
+        s = Sequencer(timer=VirtualTimer(), dispatcher=InlineDispatcher())
+        s.load_sequence_file(filename)
+        s.environment.inject_global('noop', noop)
+        begin = time.perf_counter()
+        s._eval_steps()
+        steps = sum(m['calls'] for m in s.metrics.summary().values())
+        return (time.perf_counter() - begin, steps)
+
+    (t, steps) = min(run() for i in range(repeat))
+    return dict(steps=steps, seconds=t, ns_per_step=t / steps * 1e9)
+
+
+def bench_csvlog(rows, repeat):
+    results = dict()
+    for cls in (CsvLog, BufferedCsvLog):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'log.csv')
+
+            def write():
+                log = cls(filename)
+                log.header('bench', 'a', 'b', 'c')
+                for i in range(rows):
+                    log.write('bench', i, 1.5, 'text')
+                log.close()
+
+            t = best_of(write, repeat)
+        results[cls.__name__] = dict(rows=rows, seconds=t,
+                                     rows_per_second=rows / t)
+    return results
+
+
+class BenchDataCache(DataCacheThread):
+    def __init__(self, copy_data):
+        DataCacheThread.__init__(self, copy_data=copy_data)
+        self.daemon = True
+
+    def aquire_data(self):
+        return dict(('channel%d' % i, float(i)) for i in range(100))
+
+
+def bench_datacache(reads):
+    results = dict()
+    for copy_data in (True, False):
+        cache = BenchDataCache(copy_data)
+        cache.start()
+        histogram = LatencyHistogram()
+        seqno = 0
+        for i in range(reads):
+            # wait for fresh data, otherwise every read logs a warning
+            while cache.seqno == seqno:
+                time.sleep(0)
+            seqno = cache.seqno
+            begin = time.perf_counter()
+            cache.get_data()
+            histogram.record(time.perf_counter() - begin)
+        cache.stop()
+        results['copy' if copy_data else 'snapshot'] = histogram.summary()
+    return results
+
+
+def main():
+    usage = "usage: %prog [options]"
+
+    parser = OptionParser(usage=usage)
+    parser.add_option('-s', '--sizes', dest='sizes', default=DEFAULT_SIZES,
+                      help='comma separated numbers of single steps of the '
+                      'generated sequences [default: %default]')
+    parser.add_option('-r', '--repeat', type='int', dest='repeat', default=3,
+                      help='number of runs, the fastest counts '
+                      '[default: %default]')
+    parser.add_option('--rows', type='int', dest='rows', default=200000,
+                      help='number of CSV log rows [default: %default]')
+    parser.add_option('--reads', type='int', dest='reads', default=10000,
+                      help='number of data cache reads [default: %default]')
+    parser.add_option('-o', '--output', dest='output', metavar='FILE',
+                      help='write the results as JSON to FILE instead of '
+                      'stdout')
+
+    (options, args) = parser.parse_args()
+    sizes = [int(size) for size in options.sizes.split(',')]
+
+    results = dict(version=__version__,
+                   python=platform.python_version(),
+                   platform=platform.platform(),
+                   timestamp=time.time(),
+                   sequences=list())
+
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            filename = os.path.join(directory, 'bench%d.seq' % size)
+            generate_sequence(filename, size)
+            print('Sequence with %d single steps' % size, file=sys.stderr)
+            results['sequences'].append(dict(
+                size=size,
+                parser=bench_parser(filename, options.repeat),
+                build=bench_build(filename, options.repeat),
+                dispatch=bench_dispatch(filename, options.repeat)))
+
+    print('CSV log', file=sys.stderr)
+    results['csvlog'] = bench_csvlog(options.rows, options.repeat)
+    print('Data cache', file=sys.stderr)
+    results['datacache'] = bench_datacache(options.reads)
+
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,20 @@
+import os
+import bisect
 import sqlite3
+import operator
+import functools
 from flask import Flask, render_template, request, url_for, flash, redirect
+from flask import jsonify, Response
+from flask_socketio import SocketIO, join_room
 from werkzeug.exceptions import abort
 from .qseq.sequencer import Sequencer  # type: ignore
+from .qseq.seqcache import SequenceCache, ScriptCache  # type: ignore
+from .qseq.envpool import EnvironmentPool  # type: ignore
+from .qseq.metrics import format_prometheus  # type: ignore
+from .qseq.catalog import SequenceCatalog  # type: ignore
+from .qseq.timeline import TimelineIndex  # type: ignore
+from .runs import RunManager
+from .history import RunHistory
 
 
 def get_db_connection():
@@ -22,14 +35,49 @@ def get_post(post_id):
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your secret key'
+socketio = SocketIO(app)
+history = RunHistory('history.db')
+script_cache = ScriptCache()
+# number of prewarmed environments per sequence, prewarming runs the
+# resource scripts of a sequence as soon as its page is viewed, 0 disables
+# the pool
+ENVIRONMENT_POOL_SIZE = 0
+
+if ENVIRONMENT_POOL_SIZE:
+    environments = EnvironmentPool(ENVIRONMENT_POOL_SIZE, script_cache)
+else:
+    environments = None
+runs = RunManager(socketio, history, environments, script_cache)
+
+# directory where the sequence files are located
+SEQUENCE_DIR = '../sequence'
+
+sequence_cache = SequenceCache()
+catalog = SequenceCatalog(SEQUENCE_DIR)
+
+# pagination of the schedule api
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# number of buckets of the finest timeline level and the maximum number of
+# buckets per timeline request
+TIMELINE_RESOLUTION = 16384
+MAX_TIMELINE_BUCKETS = 2000
 
 
 @app.route('/')
 def index():
-    conn = get_db_connection()
-    posts = conn.execute('SELECT * FROM posts').fetchall()
-    conn.close()
-    return render_template('index.html', posts=posts)
+    query = request.args.get('q', '')
+    return render_template('index.html', sequences=catalog.list(query),
+                           query=query)
+
+
+@app.route('/api/sequences')
+def sequence_list():
+    """Returns the metadata of the sequence files as JSON, optionally
+    filtered by the query parameter q."""
+    return jsonify(sequences=[info._asdict() for info in
+                              catalog.list(request.args.get('q'))])
 
 
 @app.route('/<int:post_id>')
@@ -90,37 +138,160 @@ def delete(id):
     return redirect(url_for('index'))
 
 
-class File_value():
-    def __init__(self, filepath):
-
-        self.sequence(filepath)
-
-    def sequence(self, file):
-        file_dir = '../sequence/'+file  # directory where sequence file is located # noqa E501
-        sequences = Sequencer()
-        sequences.load_sequence_file(file_dir)
-        Timestamps = ''
-        method = ''
-        status = ''
-        for line in sequences.schedule:
-            Timestamps = Timestamps + (str(line).split('SequenceStep')[1].split('=')[1].split(',')[0]) + ':' # noqa E501
-            method = method + (str(line).split('SequenceStep')[1].split('=')[2].replace("'", "").replace('(', '').replace(')', '')) + ':' # noqa E501
-            status = status + ('waiting') + ':'
-        print(Timestamps)
-        self.Timestamps = Timestamps.split(':') # noqa E501
-        self.method = method.split(':')
-        self.status = status.split(':')
-        i = 1
-        nb_value = list()
-        while i < len(self.Timestamps):
-            val = str(i)
-            nb_value.append(val)
-            i = i + 1
-        self.tms = {a: [b, c, d] for a, b, c, d in zip(nb_value, self.Timestamps, self.method , self.status)} # noqa E501
+def sequence_path(file):
+    return os.path.join(SEQUENCE_DIR, file)
+
+
+def _sequence_key(file):
+    file_dir = sequence_path(file)
+    try:
+        st = os.stat(file_dir)
+    except OSError:
+        abort(404)
+    return (file_dir, st.st_mtime_ns, st.st_size)
+
+
+def load_sequence(file):
+    """Returns the Sequencer for a file in the sequence directory.
+
+    Loaded sequences are kept in memory as long as the file is unchanged.
+    """
+    return _load_sequence(*_sequence_key(file))
+
+
+def load_timeline(file):
+    """Returns the TimelineIndex for a file in the sequence directory, it is
+    kept in memory as long as the file is unchanged."""
+    return _load_timeline(*_sequence_key(file))
+
+
+@functools.lru_cache(maxsize=8)
+def _load_sequence(file_dir, mtime_ns, size):
+    sequences = Sequencer()
+    sequences.load_sequence_file(file_dir, cache=sequence_cache,
+                                 with_schedule=True)
+    return sequences
+
+
+@functools.lru_cache(maxsize=8)
+def _load_timeline(file_dir, mtime_ns, size):
+    seq = _load_sequence(file_dir, mtime_ns, size)
+    return TimelineIndex(seq.schedule, seq.run_time, TIMELINE_RESOLUTION)
+
+
+def _int_arg(name, default):
+    try:
+        return int(request.args.get(name, default))
+    except ValueError:
+        abort(400)
+
+
+def _float_arg(name):
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        abort(400)
+
+
+@app.route('/api/sequence/<file>/schedule')
+def sequence_schedule(file):
+    """Returns a page of the schedule as JSON.
+
+    Query parameters: offset and limit select the page, start and end
+    restrict the steps to a time window (in seconds). The offset is relative
+    to the first step of the window.
+    """
+    schedule = load_sequence(file).schedule
+    offset = max(0, _int_arg('offset', 0))
+    limit = min(max(0, _int_arg('limit', DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+    start = _float_arg('start')
+    end = _float_arg('end')
+
+    timestamp = operator.attrgetter('timestamp')
+    first = 0
+    last = len(schedule)
+    if start is not None:
+        first = bisect.bisect_left(schedule, start, key=timestamp)
+    if end is not None:
+        last = max(first, bisect.bisect_right(schedule, end, key=timestamp))
+
+    page_begin = min(first + offset, last)
+    page_end = min(page_begin + limit, last)
+    statuses = runs.step_statuses(file, page_begin, page_end)
+    steps = [dict(index=i, timestamp=step.timestamp, method=step.method,
+                  status=statuses.get(i, 'waiting'))
+             for (i, step) in enumerate(schedule[page_begin:page_end],
+                                        page_begin)]
+    return jsonify(file=file, total=last - first, offset=offset, limit=limit,
+                   start=start, end=end, steps=steps)
+
+
+@app.route('/api/sequence/<file>/timeline')
+def sequence_timeline(file):
+    """Returns the number of steps per method and time bucket as JSON.
+
+    Query parameters: start and end select the time window (in seconds),
+    buckets the approximate number of buckets. The counts are taken from a
+    precomputed multi-resolution index, so the response time does not depend
+    on the number of steps.
+    """
+    timeline = load_timeline(file)
+    buckets = min(max(1, _int_arg('buckets', 200)), MAX_TIMELINE_BUCKETS)
+    result = timeline.query(_float_arg('start'), _float_arg('end'), buckets)
+    return jsonify(file=file, total=timeline.total, **result)
 
 
 @app.route('/<file>/sequence', methods=['GET', 'POST'])
 def sequence_page(file):
-    seq = File_value(file)
-    seq.sequence(file)
-    return render_template('sequence.html', sequence=seq) # noqa E501
+    seq = load_sequence(file)
+    if environments is not None:
+        # the run button is likely to be pressed next
+        environments.prewarm([seq.resource_path(r) for r in seq.resources])
+    return render_template('sequence.html', file=file, sequence=seq,
+                           run=runs.latest_info(file),
+                           page_size=DEFAULT_PAGE_SIZE)
+
+
+@app.route('/api/sequence/<file>/run', methods=('POST',))
+def sequence_run(file):
+    """Starts a run of the sequence in a background worker. The step events
+    are pushed to the socket.io room of the file."""
+    load_sequence(file)
+    run = runs.start(file, sequence_path(file))
+    if run is None:
+        return jsonify(error='Sequence is already running'), 409
+    return jsonify(run.info()), 202
+
+
+@app.route('/api/sequence/<file>/runs')
+def sequence_runs(file):
+    """Returns the latest runs of the sequence from the run history."""
+    limit = min(max(1, _int_arg('limit', 20)), MAX_PAGE_SIZE)
+    return jsonify(file=file, runs=history.runs(file, limit))
+
+
+@app.route('/api/runs/<run_id>')
+def run_info(run_id):
+    info = runs.get_info(run_id)
+    if info is None:
+        abort(404)
+    return jsonify(info)
+
+
+@app.route('/metrics')
+def metrics():
+    """Returns the step metrics of the latest run of every sequence in the
+    Prometheus text format."""
+    sources = [(dict(file=run.file, run_id=run.id), run.metrics)
+               for run in runs.latest_runs() if run.metrics is not None]
+    return Response(format_prometheus(sources),
+                    mimetype='text/plain; version=0.0.4')
+
+
+@socketio.on('watch')
+def watch_sequence(data):
+    """Subscribes the client to the run events of a sequence file."""
+    join_room(data['file'])
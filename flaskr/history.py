@@ -0,0 +1,143 @@
+import time
+import sqlite3
+import threading
+
+from .qseq.batching import BatchWriter  # type: ignore
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id TEXT PRIMARY KEY,
+    file TEXT NOT NULL,
+    state TEXT NOT NULL,
+    error TEXT,
+    started REAL,
+    finished REAL
+);
+
+CREATE INDEX IF NOT EXISTS runs_file_started ON runs (file, started);
+
+CREATE TABLE IF NOT EXISTS steps (
+    run_id TEXT NOT NULL,
+    step INTEGER NOT NULL,
+    timestamp REAL,
+    method TEXT,
+    status TEXT NOT NULL,
+    duration REAL,
+    error TEXT,
+    recorded REAL NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS steps_run_step ON steps (run_id, step);
+CREATE INDEX IF NOT EXISTS steps_run_timestamp ON steps (run_id, timestamp);
+'''
+
+RUN_COLUMNS = ('id', 'file', 'state', 'error', 'started', 'finished')
+
+
+class RunHistory(object):
+    """Persists the runs and their finished steps in a SQLite database.
+
+    The database is used in WAL mode, so the web requests can read while a
+    run is written. Every thread reuses its own connection. Step events are
+    queued and inserted in batches by a background thread, every
+    flush_interval seconds or as soon as batch_size steps are queued, so a
+    high-rate sequence costs one transaction per batch instead of one per
+    step. Only the end of a step (status 'done' or 'error') is stored, the
+    running state is only pushed live.
+    """
+
+    def __init__(self, path, batch_size=1000, flush_interval=0.5):
+        self.path = path
+        self.local = threading.local()
+
+        conn = self.connection()
+        conn.executescript(SCHEMA)
+
+        self.writer = BatchWriter(self._write_steps, 'qseq-history',
+                                  batch_size, flush_interval)
+
+    def connection(self):
+        """Returns the connection of the calling thread."""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+        return conn
+
+    def save_run(self, info):
+        """Inserts or updates a run, info is a dict as returned by
+        SequenceRun.info()."""
+        conn = self.connection()
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO runs (%s) VALUES (%s)' % (
+                ', '.join(RUN_COLUMNS), ', '.join('?' * len(RUN_COLUMNS))),
+                [info[name] for name in ('run_id',) + RUN_COLUMNS[1:]])
+
+    def add_step(self, run_id, status, data):
+        """Queues a finished step, data is the data of the step event."""
+        self.writer.put((run_id, data['index'], data.get('timestamp'),
+                         data.get('method'), status, data.get('duration'),
+                         data.get('error'), time.time()))
+
+    def _write_steps(self, rows):
+        conn = self.connection()
+        with conn:
+            conn.executemany('INSERT INTO steps (run_id, step, timestamp, '
+                             'method, status, duration, error, recorded) '
+                             'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+    def flush(self):
+        """Blocks until all queued steps are written."""
+        self.writer.flush()
+
+    def close(self):
+        self.writer.close()
+
+    def _run_info(self, row):
+        if row is None:
+            return None
+        info = dict(row)
+        info['run_id'] = info.pop('id')
+        return info
+
+    def get_run(self, run_id):
+        """Returns the info dict of a run or None."""
+        row = self.connection().execute('SELECT * FROM runs WHERE id = ?',
+                                        (run_id,)).fetchone()
+        return self._run_info(row)
+
+    def latest_run(self, file):
+        """Returns the info dict of the latest run of a file or None."""
+        row = self.connection().execute(
+            'SELECT * FROM runs WHERE file = ? ORDER BY started DESC '
+            'LIMIT 1', (file,)).fetchone()
+        return self._run_info(row)
+
+    def runs(self, file, limit=20):
+        """Returns the info dicts of the latest runs of a file, newest
+        first."""
+        rows = self.connection().execute(
+            'SELECT * FROM runs WHERE file = ? ORDER BY started DESC '
+            'LIMIT ?', (file, limit)).fetchall()
+        return [self._run_info(row) for row in rows]
+
+    def step_statuses(self, run_id, first, last):
+        """Returns a dict mapping the indices first <= index < last of the
+        stored steps of a run to their status."""
+        rows = self.connection().execute(
+            'SELECT step, status FROM steps WHERE run_id = ? AND '
+            'step >= ? AND step < ?', (run_id, first, last))
+        return dict((row['step'], row['status']) for row in rows)
+
+    def steps_between(self, run_id, start, end, limit=1000):
+        """Returns the stored steps of a run with start <= timestamp <= end
+        as dicts, ordered by timestamp."""
+        rows = self.connection().execute(
+            'SELECT step, timestamp, method, status, duration, error, '
+            'recorded FROM steps WHERE run_id = ? AND timestamp >= ? AND '
+            'timestamp <= ? ORDER BY timestamp, step LIMIT ?',
+            (run_id, start, end, limit)).fetchall()
+        return [dict(row) for row in rows]
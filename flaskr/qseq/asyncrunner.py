@@ -0,0 +1,134 @@
+import time
+import asyncio
+import inspect
+import logging
+
+from .sequencer import Sequencer
+from .timestamp import set_clock
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncSequencer(Sequencer):
+    """A sequencer which runs the sequence on an asyncio event loop.
+
+    Methods may return awaitables (e.g. call a coroutine function defined
+    with 'async def' in a resource script), which are awaited on the loop.
+    Every step is started as its own task at its scheduled time, so steps
+    with the same or overlapping times run concurrently without a thread per
+    step. Plain functions are still supported, but they block the loop while
+    they are running.
+
+    Initialization methods are evaluated one after the other before the
+    first step, and finalization methods one after the other once all steps
+    are finished.
+
+    If max_concurrency is set, at most that many steps are running at the
+    same time. Further steps wait for a free slot.
+    """
+
+    def __init__(self, streaming=False, timer=None, log=None,
+                 max_concurrency=None, script_cache=None):
+        Sequencer.__init__(self, streaming=streaming, timer=timer, log=log,
+                           script_cache=script_cache)
+        self.max_concurrency = max_concurrency
+
+    async def _evaluate(self, method):
+        eval_begin = time.monotonic()
+        ret = self.environment.evaluate(method)
+        eval_end = time.monotonic()
+
+        if (eval_end - eval_begin > 1):
+            logger.warning('Evaluating %s blocked the event loop for more '
+                           'than 1 second. Consider using a coroutine.',
+                           method)
+
+        if inspect.isawaitable(ret):
+            ret = await ret
+        return ret
+
+    async def _eval_step_async(self, method, semaphore, index, ts):
+        logger.debug('Evaluating %s', method)
+        self._step_started(index, ts, method)
+        eval_begin = time.monotonic()
+        error = None
+        try:
+            if semaphore is None:
+                await self._evaluate(method)
+            else:
+                async with semaphore:
+                    await self._evaluate(method)
+        except (KeyboardInterrupt, asyncio.CancelledError):
+            raise
+        except Exception as e:
+            logger.exception('Exception in step %s', method)
+            error = e
+        eval_end = time.monotonic()
+        self.metrics.record(method, eval_end - eval_begin, error)
+        self._step_finished(index, ts, method, eval_end - eval_begin, error)
+
+    async def _eval_initializations_async(self):
+        for method in self.initializations:
+            logger.debug('Evaluating %s', method)
+            await self._evaluate(method)
+
+    async def _eval_steps_async(self):
+        semaphore = None
+        if self.max_concurrency is not None:
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        tasks = set()
+        self.timer.start()
+        try:
+            for (index, (ts, order, method)) in enumerate(self._iter_steps()):
+                if order in self._periods and self._overrun(ts, order,
+                                                            method):
+                    continue
+                delay = self.timer.remaining(ts)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                lateness = self.timer.record_start(ts)
+                self.metrics.record_lateness(method, lateness)
+
+                task = asyncio.ensure_future(
+                    self._eval_step_async(method, semaphore, index, ts))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                if self.timer.virtual:
+                    # let the step start before the virtual clock advances
+                    await asyncio.sleep(0)
+
+            if tasks:
+                await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+        logger.info(self.timer.format_summary())
+
+    async def _eval_finalizations_async(self):
+        for method in self.finalizations:
+            logger.debug('Evaluating %s', method)
+            await self._evaluate(method)
+
+    async def start_async(self):
+        if self.timer.virtual:
+            set_clock(self.timer)
+        self._run_started()
+        try:
+            self._inject_globals()
+            self._load_resources()
+            await self._eval_initializations_async()
+            await self._eval_steps_async()
+            await self._eval_finalizations_async()
+        except BaseException as e:
+            self.log.flush()
+            self._run_finished(e)
+            raise
+        finally:
+            if self.timer.virtual:
+                set_clock(None)
+        self.log.flush()
+        self._run_finished()
+
+    def start(self):
+        asyncio.run(self.start_async())
@@ -0,0 +1,104 @@
+import logging
+import threading
+import collections
+
+logger = logging.getLogger(__name__)
+
+
+class BatchWriter(object):
+    """Hands queued items over to a write function in batches, from a
+    background thread.
+
+    put() only appends the item to a queue. The writer thread wakes up every
+    flush_interval seconds or as soon as batch_size items are queued and
+    calls write(items) with at most batch_size items at once. If max_queue is
+    set and the queue is full, put() blocks until the writer has caught up.
+
+    An exception raised by write() is logged and the batch is dropped, the
+    writer keeps running. If the writer thread is gone anyway, flush() and
+    put() do not wait for it.
+    """
+
+    def __init__(self, write, name, batch_size=1000, flush_interval=0.5,
+                 max_queue=None):
+        self.write = write
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        # appending to a deque is thread-safe, the condition is only used
+        # when the queue is full or the caller waits for the writer
+        self.items = collections.deque()
+        # the number of items of the batch being written and of the items
+        # which were handed over to write() so far
+        self.writing = 0
+        self.written = 0
+        self.stop_request = False
+        self.wakeup = threading.Event()
+        self.drained = threading.Condition()
+        self.alive = True
+        self.thread = threading.Thread(target=self._run, daemon=True,
+                                       name=name)
+        self.thread.start()
+
+    def __len__(self):
+        return len(self.items)
+
+    def put(self, item):
+        if self.max_queue is not None and len(self.items) >= self.max_queue:
+            with self.drained:
+                self.wakeup.set()
+                self.drained.wait_for(
+                    lambda: len(self.items) < self.max_queue or
+                    not self.alive)
+        self.items.append(item)
+        if len(self.items) == self.batch_size:
+            self.wakeup.set()
+
+    def _write_batch(self):
+        with self.drained:
+            count = min(len(self.items), self.batch_size)
+            items = [self.items.popleft() for i in range(count)]
+            self.writing = count
+        try:
+            self.write(items)
+        except Exception:
+            logger.exception('Failed to write %d item(s) in %s', len(items),
+                             self.thread.name)
+        finally:
+            with self.drained:
+                self.writing = 0
+                self.written += count
+                self.drained.notify_all()
+
+    def _run(self):
+        try:
+            while True:
+                self.wakeup.wait(self.flush_interval)
+                self.wakeup.clear()
+                stop = self.stop_request
+                while self.items:
+                    self._write_batch()
+                if stop:
+                    break
+        finally:
+            # wake up callers waiting for a writer which is gone
+            with self.drained:
+                self.alive = False
+                self.drained.notify_all()
+
+    def flush(self):
+        """Blocks until all items queued before the call are written. Items
+        queued meanwhile are not waited for, so flush() returns even if
+        items are queued continuously."""
+        with self.drained:
+            target = self.written + self.writing + len(self.items)
+            self.wakeup.set()
+            self.drained.wait_for(
+                lambda: self.written >= target or not self.alive)
+
+    def close(self):
+        """Writes the remaining items and stops the writer thread."""
+        if self.thread.is_alive():
+            self.stop_request = True
+            self.wakeup.set()
+            self.thread.join()
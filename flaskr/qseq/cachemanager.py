@@ -0,0 +1,170 @@
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .timing import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+# refetch as soon as a consumer collected the previous data
+REFRESH_ON_CONSUME = 'on_consume'
+# refetch every interval seconds on a fixed grid, regardless of consumers
+REFRESH_FIXED_RATE = 'fixed_rate'
+# refetch when the data is older than interval seconds
+REFRESH_MAX_AGE = 'max_age'
+
+REFRESH_POLICIES = (REFRESH_ON_CONSUME, REFRESH_FIXED_RATE, REFRESH_MAX_AGE)
+
+
+class CacheSource(object):
+    """The state of a DataCache managed by a CacheManager."""
+
+    def __init__(self, name, cache, policy, interval):
+        self.name = name
+        self.cache = cache
+        self.policy = policy
+        self.interval = interval
+        self.in_flight = False
+        self.halted = False
+        self.consumed = True
+        self.started = None
+        self.next_fetch = time.monotonic()
+        self.fetches = 0
+        self.errors = 0
+        self.latency = LatencyHistogram()
+
+    def due(self, now):
+        """Returns the time of the next fetch or None if the source waits
+        for a consumer."""
+        if self.in_flight or self.halted:
+            return None
+        if self.policy == REFRESH_ON_CONSUME:
+            return now if self.consumed else None
+        return self.next_fetch
+
+
+class CacheManager(object):
+    """Runs many data caches on a shared, bounded pool of worker threads.
+
+    Instead of one thread per DataCacheThread, the manager fetches the data
+    of all its caches (instances of DataCache) in max_workers threads. Every
+    cache is fetched once on start and then according to its refresh policy:
+
+     - REFRESH_ON_CONSUME: as soon as a consumer collected the previous data,
+       like DataCacheThread does
+     - REFRESH_FIXED_RATE: every interval seconds, the fetches are aligned to
+       a fixed grid starting at the first fetch
+     - REFRESH_MAX_AGE: when the data is older than interval seconds,
+       measured from the start of the last fetch
+
+    A cache is never fetched twice at the same time. If halt_on_errors is set
+    on a cache, it is not fetched again after an exception.
+
+    The latency of every fetch is recorded per source, see stats().
+    """
+
+    def __init__(self, max_workers=4):
+        self.max_workers = max_workers
+        self.sources = list()
+        self.by_cache = dict()
+        self.executor = None
+        self.thread = None
+        self.stop_request = False
+        self.cond = threading.Condition()
+
+    def add(self, cache, policy=REFRESH_ON_CONSUME, interval=None,
+            name=None):
+        """Adds a DataCache and returns its CacheSource."""
+        if policy not in REFRESH_POLICIES:
+            raise ValueError('Unknown refresh policy %r' % (policy,))
+        if policy != REFRESH_ON_CONSUME and not interval:
+            raise ValueError('Refresh policy %s needs an interval' % policy)
+        if name is None:
+            name = '%s-%d' % (cache.__class__.__name__, len(self.sources))
+
+        source = CacheSource(name, cache, policy, interval)
+        cache.on_consumed = self._on_consumed
+        with self.cond:
+            self.sources.append(source)
+            self.by_cache[id(cache)] = source
+            self.cond.notify()
+        return source
+
+    def _on_consumed(self, cache):
+        with self.cond:
+            self.by_cache[id(cache)].consumed = True
+            self.cond.notify()
+
+    def _fetch(self, source):
+        try:
+            duration = source.cache._acquire()
+            source.latency.record(duration)
+        except Exception:
+            source.errors += 1
+            source.halted = True
+            logger.error('Source %s halted after an error', source.name)
+        finally:
+            source.fetches += 1
+
+        with self.cond:
+            source.in_flight = False
+            if source.policy == REFRESH_FIXED_RATE:
+                # skip the slots which were missed during the fetch
+                now = time.monotonic()
+                while source.next_fetch <= now:
+                    source.next_fetch += source.interval
+            elif source.policy == REFRESH_MAX_AGE:
+                source.next_fetch = source.started + source.interval
+            self.cond.notify()
+
+    def _run(self):
+        with self.cond:
+            while not self.stop_request:
+                now = time.monotonic()
+                wakeup = None
+                for source in self.sources:
+                    due = source.due(now)
+                    if due is None:
+                        continue
+                    if due <= now:
+                        source.in_flight = True
+                        source.consumed = False
+                        source.started = now
+                        self.executor.submit(self._fetch, source)
+                    elif wakeup is None or due < wakeup:
+                        wakeup = due
+                timeout = None if wakeup is None else wakeup - now
+                self.cond.wait(timeout)
+
+    def start(self):
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                           thread_name_prefix='qseq-cache')
+        self.thread = threading.Thread(target=self._run, daemon=True,
+                                       name='qseq-cachemanager')
+        self.thread.start()
+
+    def stop(self):
+        """Stops all sources, waits for running fetches and calls cleanup()
+        of every cache."""
+        with self.cond:
+            self.stop_request = True
+            self.cond.notify()
+        self.thread.join()
+        self.executor.shutdown(wait=True)
+        for source in self.sources:
+            source.cache.on_consumed = None
+            try:
+                source.cache.cleanup()
+            except Exception:
+                logger.exception('Exception in cleanup of %s', source.name)
+
+    def stats(self):
+        """Returns a dict mapping the source names to the number of fetches,
+        errors, whether the source is halted and the fetch latency
+        summary."""
+        return dict((source.name, dict(fetches=source.fetches,
+                                       errors=source.errors,
+                                       halted=source.halted,
+                                       latency=source.latency.summary()))
+                    for source in self.sources)
@@ -0,0 +1,100 @@
+import os
+import logging
+import threading
+from collections import namedtuple
+
+from .sequencer import Sequencer
+from .seqcache import file_hash
+
+logger = logging.getLogger(__name__)
+
+SequenceInfo = namedtuple("SequenceInfo", "name path mtime_ns size hash "
+                          "steps run_time resources error")
+
+
+def read_sequence_info(name, path, st, digest):
+    """Parses a sequence file and returns its SequenceInfo.
+
+    The file is loaded in streaming mode and the steps are counted per
+    command, thus neither the schedule is held in memory nor are the steps
+    generated. Errors are stored in the info instead of being raised.
+    """
+    s = Sequencer(streaming=True)
+    steps = None
+    error = None
+    try:
+        s.load_sequence_file(path)
+        steps = s.step_count()
+    except Exception as e:
+        error = str(e)
+    return SequenceInfo(name, path, st.st_mtime_ns, st.st_size, digest,
+                        steps, s.run_time, tuple(s.resources), error)
+
+
+class SequenceCatalog(object):
+    """An index of the sequence files (*.seq) in a directory.
+
+    The metadata of every file, that is the number of steps, the run time,
+    the resource files, a parse error if any and the content hash, is kept
+    in memory. refresh() only parses files whose modification time or size
+    changed and whose content hash differs, so listing a directory with
+    hundreds of sequences costs one stat() per file.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.entries = dict()
+
+    def _update(self, name, path, st):
+        entry = self.entries.get(name)
+        if entry is not None and entry.mtime_ns == st.st_mtime_ns and \
+                entry.size == st.st_size:
+            return entry
+        digest = file_hash(path)
+        if entry is not None and entry.hash == digest:
+            # touched, but unchanged
+            return entry._replace(mtime_ns=st.st_mtime_ns)
+        logger.debug('Reading sequence %s', path)
+        return read_sequence_info(name, path, st, digest)
+
+    def refresh(self):
+        """Rescans the directory and updates the entries of new and changed
+        files. Entries of deleted files are removed."""
+        with self.lock:
+            try:
+                dirents = list(os.scandir(self.directory))
+            except OSError:
+                logger.warning('Cannot read sequence directory %s',
+                               self.directory)
+                dirents = list()
+            entries = dict()
+            for dirent in dirents:
+                if not dirent.name.endswith('.seq'):
+                    continue
+                try:
+                    entries[dirent.name] = self._update(dirent.name,
+                                                        dirent.path,
+                                                        dirent.stat())
+                except OSError:
+                    # deleted while scanning
+                    continue
+            self.entries = entries
+
+    def get(self, name):
+        """Returns the SequenceInfo of a file or None."""
+        self.refresh()
+        return self.entries.get(name)
+
+    def list(self, query=None):
+        """Returns the SequenceInfo of all files sorted by name. If query is
+        given, only files whose name or resources contain it are
+        returned."""
+        self.refresh()
+        entries = sorted(self.entries.values())
+        if query:
+            query = query.lower()
+            entries = [e for e in entries
+                       if query in e.name.lower() or
+                       any(query in r.lower() for r in e.resources)]
+        return entries
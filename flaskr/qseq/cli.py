@@ -1,12 +1,18 @@
 #!/usr/bin/env python3.11
 
 import sys
+import time
 import os.path
 import logging
 from optparse import OptionParser
 
 from qseq import __version__
-from qseq.sequencer import Sequencer
+from qseq.sequencer import Sequencer, OVERRUN_POLICIES
+from qseq.asyncrunner import AsyncSequencer
+from qseq.seqcache import SequenceCache, ScriptCache
+from qseq.csvlog import CsvLog, BufferedCsvLog
+from qseq.timing import MonotonicTimer, HybridTimer, VirtualTimer
+from qseq.dispatch import InlineDispatcher, PoolDispatcher
 
 
 def main():
@@ -20,6 +26,48 @@ def main():
                       help='show version')
     parser.add_option('--dry-run', action='store_true', dest='dry_run',
                       help="don't execute any methods")
+    parser.add_option('--simulate', action='store_true', dest='simulate',
+                      help='execute the methods as fast as possible on a '
+                      'virtual clock instead of in real time')
+    parser.add_option('-l', '--log', dest='log', metavar='FILE',
+                      help='write the qseq_log output to FILE instead of '
+                      'stdout')
+    parser.add_option('--buffered-log', action='store_true',
+                      dest='buffered_log',
+                      help='format and write the log in a background thread')
+    parser.add_option('--no-cache', action='store_false', dest='cache',
+                      default=True,
+                      help="don't use the compiled sequence and resource "
+                      "cache")
+    parser.add_option('--streaming', action='store_true', dest='streaming',
+                      help='read the sequence file while running instead of '
+                      'keeping the parsed file in memory, the sequence '
+                      'cache is not used')
+    parser.add_option('--hot-reload', action='store_true', dest='hot_reload',
+                      help='reschedule the remaining steps when the sequence '
+                      'file is changed while running')
+    parser.add_option('--spin', type='float', dest='spin', metavar='SECONDS',
+                      help='busy wait the last SECONDS before each step for '
+                      'sub-millisecond accuracy')
+    parser.add_option('--jitter', action='store_true', dest='jitter',
+                      help='print the step start lateness after the run')
+    parser.add_option('--overrun', type='choice', dest='overrun',
+                      choices=OVERRUN_POLICIES, default=OVERRUN_POLICIES[0],
+                      help='what to do with missed periodic steps when the '
+                      'sequencer falls behind: %s [default: %%default]' %
+                      ', '.join(OVERRUN_POLICIES))
+    parser.add_option('--metrics', action='store_true', dest='metrics',
+                      help='print the calls, evaluation time and lateness '
+                      'of every method after the run')
+    parser.add_option('-w', '--workers', type='int', dest='workers',
+                      help='execute the steps in a pool of WORKERS threads')
+    parser.add_option('--timeout', type='float', dest='timeout',
+                      metavar='SECONDS',
+                      help='report steps running longer than SECONDS '
+                      '(only with --workers)')
+    parser.add_option('--asyncio', action='store_true', dest='asyncio',
+                      help='run the sequence on an asyncio event loop and '
+                      'await methods returning coroutines')
 
     (options, args) = parser.parse_args()
 
@@ -35,10 +83,60 @@ def main():
     if options.verbose:
         logging.getLogger().setLevel(logging.DEBUG)
 
-    s = Sequencer()
-    s.load_sequence_file(args[0])
+    if options.simulate:
+        if options.workers:
+            parser.error('--simulate and --workers are mutually exclusive')
+        timer = VirtualTimer()
+    elif options.spin is not None:
+        timer = HybridTimer(options.spin)
+    else:
+        timer = MonotonicTimer()
+
+    if options.buffered_log:
+        log = BufferedCsvLog(options.log)
+    elif options.log:
+        log = CsvLog(options.log)
+    else:
+        log = None
+
+    script_cache = ScriptCache() if options.cache else None
+
+    if options.asyncio:
+        if options.workers:
+            parser.error('--asyncio and --workers are mutually exclusive')
+        if options.hot_reload:
+            parser.error('--hot-reload is not supported with --asyncio')
+        s = AsyncSequencer(streaming=options.streaming, timer=timer, log=log,
+                           script_cache=script_cache)
+    else:
+        if options.workers:
+            dispatcher = PoolDispatcher(max_workers=options.workers,
+                                        timeout=options.timeout)
+        else:
+            dispatcher = InlineDispatcher()
+        if options.streaming and options.hot_reload:
+            parser.error('--hot-reload is not supported with --streaming')
+        s = Sequencer(streaming=options.streaming, timer=timer,
+                      dispatcher=dispatcher, log=log,
+                      script_cache=script_cache,
+                      hot_reload=options.hot_reload)
+    s.set_overrun_policy(options.overrun)
+    s.load_sequence_file(args[0],
+                         cache=SequenceCache() if options.cache else None)
     if not options.dry_run:
-        s.start()
+        started = time.monotonic()
+        try:
+            s.start()
+        finally:
+            if log is not None:
+                log.close()
+        if options.simulate:
+            print('Simulated %.2f s in %.2f s' % (timer.now(),
+                                                   time.monotonic() - started))
+        if options.jitter:
+            print(timer.format_summary())
+        if options.metrics:
+            print(s.metrics.format_summary())
 
 
 if __name__ == '__main__':
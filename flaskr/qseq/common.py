@@ -1,16 +1,63 @@
-def frange(start, stop, step):
+import math
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# number of values computed at once by grid_blocks()
+BLOCK_SIZE = 4096
+
+
+def _in_range(value, stop, step, inclusive):
+    if value == stop:
+        return inclusive
+    if step > 0:
+        return value < stop
+    return value > stop
+
+
+def grid_index(start, stop, step, inclusive=False):
+    """Returns the number of values start + k*step, k = 0, 1, ..., which lie
+    before stop, that is the number of values frange() yields. If inclusive
+    is True, a value equal to stop is counted as well."""
     if step == 0:
         raise ValueError('frange() step argument must not be zero')
-    if start < stop and step < 0:
-        return
-    if start > stop and step > 0:
-        return
-    cur = start
-    if start < stop:
-        while cur < stop:
-            yield cur
-            cur += step
-    else:
-        while cur > stop:
-            yield cur
-            cur += step
+    if not _in_range(start, stop, step, inclusive):
+        return 0
+    if math.isinf(stop):
+        raise ValueError('frange() stop argument must be finite')
+
+    # the estimate may be off by one due to rounding, the values themselves
+    # decide
+    k = max(0, math.ceil((stop - start) / step))
+    while _in_range(start + k * step, stop, step, inclusive):
+        k += 1
+    while k > 0 and not _in_range(start + (k - 1) * step, stop, step,
+                                  inclusive):
+        k -= 1
+    return k
+
+
+def grid_blocks(start, step, first, last, block_size=BLOCK_SIZE):
+    """Yields the values start + k*step for first <= k < last as lists of
+    at most block_size floats.
+
+    Every value is computed from its integer index, thus there is no drift
+    even after millions of steps. If numpy is available, a block is computed
+    at once. The values are the same as computed by Python.
+    """
+    for begin in range(first, last, block_size):
+        end = min(begin + block_size, last)
+        if numpy is not None:
+            k = numpy.arange(begin, end, dtype=numpy.float64)
+            yield (k * step + start).tolist()
+        else:
+            yield [start + k * step for k in range(begin, end)]
+
+
+def frange(start, stop, step):
+    """Like range() for floats. The values are computed as start + k*step,
+    so they do not accumulate rounding errors."""
+    for block in grid_blocks(start, step, 0, grid_index(start, stop, step)):
+        yield from block
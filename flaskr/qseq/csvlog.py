@@ -1,4 +1,7 @@
+import sys
+
 from .timestamp import QSEQ_TIMESTAMP
+from .batching import BatchWriter
 
 
 class CsvLog(object):
@@ -10,7 +13,7 @@ class CsvLog(object):
         else:
             self.fd = open(filename, 'w')
 
-    def _write_csv(self, *items):
+    def _format_csv(self, items):
         new_items = list()
         for i in map(str, items):
             if ',' in i:
@@ -19,11 +22,14 @@ class CsvLog(object):
                 i = '"%s"' % i
             new_items.append(i)
 
-        text = ','.join(new_items)
+        return ','.join(new_items)
+
+    def _write_csv(self, *items):
+        text = self._format_csv(items)
         if self.use_stdout:
             print(text)
         else:
-            self.fd.write(text)
+            self.fd.write(text + '\n')
 
     def header(self, modname, *items):
         if modname not in self.known_headers:
@@ -32,3 +38,62 @@ class CsvLog(object):
 
     def write(self, modname, *items):
         self._write_csv(modname, '%.6f' % QSEQ_TIMESTAMP(), *items)
+
+    def flush(self):
+        if self.use_stdout:
+            sys.stdout.flush()
+        else:
+            self.fd.flush()
+
+    def close(self):
+        if not self.use_stdout:
+            self.fd.close()
+
+
+class BufferedCsvLog(CsvLog):
+    """A CSV log which formats and writes the rows in a background thread.
+
+    header() and write() only append the row to a queue, the timestamp is
+    taken at that moment. The writer thread wakes up every flush_interval
+    seconds or as soon as flush_size rows are queued, then formats the rows
+    and writes them at once. The queue holds at most max_queue rows. If it is
+    full, the caller blocks until the writer has caught up. A row which
+    cannot be written is logged and dropped together with its batch, see
+    BatchWriter.
+
+    Call close() at the end to write the remaining rows.
+    """
+
+    def __init__(self, filename=None, flush_interval=0.5, flush_size=1000,
+                 max_queue=100000):
+        CsvLog.__init__(self, filename)
+        self.writer = BatchWriter(self._write_rows, 'qseq-csvlog',
+                                  flush_size, flush_interval, max_queue)
+
+    def _write_csv(self, *items):
+        self.writer.put(items)
+
+    def write(self, modname, *items):
+        self.writer.put((modname, QSEQ_TIMESTAMP()) + items)
+
+    def _write_rows(self, rows):
+        lines = list()
+        for row in rows:
+            if isinstance(row[1], float):
+                row = (row[0], '%.6f' % row[1]) + row[2:]
+            lines.append(self._format_csv(row))
+        text = '\n'.join(lines) + '\n'
+        if self.use_stdout:
+            sys.stdout.write(text)
+            sys.stdout.flush()
+        else:
+            self.fd.write(text)
+            self.fd.flush()
+
+    def flush(self):
+        """Blocks until all queued rows are written."""
+        self.writer.flush()
+
+    def close(self):
+        self.writer.close()
+        CsvLog.close(self)
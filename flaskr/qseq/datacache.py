@@ -2,38 +2,72 @@ import threading
 import time
 import logging
 import copy
+import collections
+from collections import namedtuple
 
 logger = logging.getLogger(__name__)
 
+Snapshot = namedtuple("Snapshot", "seqno timestamp duration data")
 
-class DataCacheThread(threading.Thread):
-    """A data cache thread is an object which fetches some data in the
-    background and stores it locally for faster access. On startup the data is
-    fetched once and after that, it is fetched again after the user has
+
+def _make_read_only(data):
+    """Marks arrays (e.g. numpy arrays) as read-only, other objects are left
+    untouched."""
+    setflags = getattr(data, 'setflags', None)
+    if setflags is not None:
+        try:
+            setflags(write=False)
+        except (TypeError, ValueError):
+            pass
+
+
+class DataCache(object):
+    """A data cache is an object which fetches some data and stores it
+    locally for faster access. The data is fetched again after the user has
     collected the previous value.
 
     Additionally, the fetched data is tagged with a timestamp and the duration
     which was needed to acquire the complete dataset.
 
-    To use this class, override the method aquire_data().
+    To use this class, override the method aquire_data(). A data cache does
+    not fetch the data on its own, use DataCacheThread for a cache with its
+    own thread or a CacheManager to run many caches on a shared pool of
+    worker threads.
 
     If halt_on_errors is set to True any exception in aquire_data() will be
     reraised. Otherwise, only an error is logged.
+
+    By default, readers get a deep copy of the data. If copy_data is set to
+    False, every fetched dataset is published as an immutable snapshot and
+    readers get the object itself without copying. In this mode aquire_data()
+    has to return a new object on every call and readers must not modify it.
+    Arrays which support setflags() (e.g. numpy arrays) are made read-only.
+
+    If history_size is greater than zero, the last history_size snapshots are
+    kept in a ring buffer. Each reader can register itself with
+    add_consumer() and read the snapshots at its own pace, see
+    DataCacheConsumer. With copy_data, a deep copy of every dataset is made
+    when it is published to the history or to consumers, because
+    aquire_data() may modify the object once a reader collected it.
+
+    If publisher is set, e.g. to a SharedMemoryPublisher, every dataset is
+    also handed over to publisher.publish(timestamp, duration, data), so
+    other processes can read it without acquiring it again.
     """
 
-    def __init__(self):
-        threading.Thread.__init__(self)
-        self.stop_request = False
+    def __init__(self, copy_data=True, history_size=0):
         self.lock = threading.Lock()
         self.halt_on_errors = False
+        self.copy_data = copy_data
         self.dataset = None
+        self.snapshot = None
+        self.seqno = 0
+        self.history = collections.deque(maxlen=history_size or None)
+        self.history_size = history_size
         self.event = threading.Event()
-
-    def stop(self):
-        """Requests a termination of the thread and waits for it."""
-        self.stop_request = True
-        self.event.set()
-        self.join()
+        self.on_consumed = None
+        self.publisher = None
+        self.consumers = 0
 
     def aquire_data(self):
         """Aquires the data.
@@ -44,35 +78,55 @@ class DataCacheThread(threading.Thread):
         raise RuntimeError('You have to override this method.')
 
     def cleanup(self):
-        """This method is called when just before the thread exists."""
+        """This method is called when the cache is stopped."""
         pass
 
-    def run(self):
-        while not self.stop_request:
-            start_time = time.time()
-            try:
-                data = self.aquire_data()
-            except KeyboardInterrupt:
+    def _acquire(self):
+        """Calls aquire_data() and publishes the result. Returns the
+        duration of the acquisition."""
+        start_time = time.time()
+        try:
+            data = self.aquire_data()
+        except KeyboardInterrupt:
+            raise
+        except Exception:  # as e
+            data = None
+            logger.exception('Exception while fetching data')
+            if self.halt_on_errors:
                 raise
-            except Exception:  # as e
-                data = None
-                logger.exception('Exception while fetching data')
-                if self.halt_on_errors:
-                    raise
-            end_time = time.time()
-
-            timestamp = start_time
-            duration = end_time - start_time
-
-            self.lock.acquire()
-            self.dataset = (timestamp, duration, data)
-            self.fetchcount = 0
-            self.lock.release()
+        end_time = time.time()
 
-            # now wait until data is collected
-            self.event.wait()
-            self.event.clear()
-        self.cleanup()
+        timestamp = start_time
+        duration = end_time - start_time
+        self._publish(timestamp, duration, data)
+        return duration
+
+    def _publish(self, timestamp, duration, data):
+        shared = data
+        if not self.copy_data:
+            _make_read_only(data)
+        elif self.history_size or self.consumers:
+            shared = copy.deepcopy(data)
+
+        self.lock.acquire()
+        self.seqno += 1
+        self.snapshot = Snapshot(self.seqno, timestamp, duration, shared)
+        self.dataset = (timestamp, duration, data)
+        if self.history_size:
+            self.history.append(self.snapshot)
+        self.fetchcount = 0
+        self.lock.release()
+
+        if self.publisher is not None:
+            try:
+                self.publisher.publish(timestamp, duration, data)
+            except Exception:
+                logger.exception('Exception while publishing data')
+
+    def _consumed(self):
+        self.event.set()
+        if self.on_consumed is not None:
+            self.on_consumed(self)
 
     def _get_data(self):
         self.lock.acquire()
@@ -82,12 +136,31 @@ class DataCacheThread(threading.Thread):
         else:
             fetchcount = self.fetchcount
             self.fetchcount += 1
-            dataset = copy.deepcopy(self.dataset)
+            if self.copy_data:
+                dataset = copy.deepcopy(self.dataset)
+            else:
+                dataset = self.dataset
         self.lock.release()
-        self.event.set()
+        self._consumed()
 
         return (fetchcount, dataset)
 
+    def get_snapshot(self):
+        """Returns the last Snapshot or None if no data was acquired yet.
+
+        The data is only copied if copy_data is set. The snapshot does not
+        count as a fetch, that is it neither triggers a new acquisition nor
+        the warning about fetching the same data multiple times.
+        """
+        if not self.copy_data:
+            return self.snapshot
+        with self.lock:
+            return copy.deepcopy(self.snapshot)
+
+    def add_consumer(self):
+        """Returns a new DataCacheConsumer for this cache."""
+        return DataCacheConsumer(self)
+
     def get_data(self):
         """Returns the last fetched data.
 
@@ -99,7 +172,7 @@ class DataCacheThread(threading.Thread):
         If no data was acquired yet, None will be returned.
         """
         (fetchcount, dataset) = self._get_data()
-        if fetchcount > 0:
+        if fetchcount is not None and fetchcount > 0:
             logger.warning('Fetch the same data multiple times')
         if dataset is None:
             return None
@@ -120,3 +193,104 @@ class DataCacheThread(threading.Thread):
                 logger.warning('Fetch the same data multiple times')
 
         return dataset
+
+
+class DataCacheThread(DataCache, threading.Thread):
+    """A data cache with its own thread. On startup the data is fetched once
+    and after that, it is fetched again after the user has collected the
+    previous value.
+
+    See DataCache for details.
+    """
+
+    def __init__(self, copy_data=True, history_size=0):
+        threading.Thread.__init__(self)
+        DataCache.__init__(self, copy_data, history_size)
+        self.stop_request = False
+
+    def stop(self):
+        """Requests a termination of the thread and waits for it."""
+        self.stop_request = True
+        self.event.set()
+        self.join()
+
+    def run(self):
+        while not self.stop_request:
+            self._acquire()
+
+            # now wait until data is collected
+            self.event.wait()
+            self.event.clear()
+        self.cleanup()
+
+
+class DataCacheConsumer(object):
+    """A reader of a DataCacheThread with its own position.
+
+    Every consumer tracks which snapshot it has read last, thus several
+    consumers can read the same data without triggering the warning about
+    fetching the same data multiple times. If the cache keeps a history,
+    get_new() returns all snapshots the consumer has not seen yet.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        with cache.lock:
+            cache.consumers += 1
+            # snapshots published before are neither new nor missed
+            self.seqno = cache.seqno
+        # the current snapshot was not read yet
+        self.fetchcount = -1
+        self.missed = 0
+
+    def _copy(self, snapshot):
+        if self.cache.copy_data:
+            return copy.deepcopy(snapshot)
+        return snapshot
+
+    def _collect(self, snapshot):
+        if snapshot.seqno == self.seqno:
+            self.fetchcount += 1
+        else:
+            self.fetchcount = 0
+            self.seqno = snapshot.seqno
+        self.cache._consumed()
+        return self.fetchcount
+
+    def get_snapshot(self):
+        """Returns the last Snapshot or None if no data was acquired yet.
+
+        If the same snapshot is fetched multiple times a warning is logged.
+        """
+        with self.cache.lock:
+            snapshot = self.cache.snapshot
+            if snapshot is not None:
+                snapshot = self._copy(snapshot)
+        if snapshot is None:
+            return None
+        if self._collect(snapshot) > 0:
+            logger.warning('Fetch the same data multiple times')
+        return snapshot
+
+    def get_data(self):
+        """Returns the last fetched data, see DataCacheThread.get_data()."""
+        snapshot = self.get_snapshot()
+        if snapshot is None:
+            return None
+        return snapshot.data
+
+    def get_new(self):
+        """Returns a list of the snapshots in the history which are newer
+        than the last one read by this consumer, oldest first.
+
+        If snapshots were dropped from the history before the consumer read
+        them, they are counted in missed.
+        """
+        with self.cache.lock:
+            snapshots = [s for s in self.cache.history
+                         if s.seqno > self.seqno]
+            snapshots = [self._copy(s) for s in snapshots]
+        if snapshots:
+            self.missed += snapshots[0].seqno - self.seqno - 1
+            self._collect(snapshots[-1])
+        return snapshots
@@ -0,0 +1,144 @@
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class InlineDispatcher(object):
+    """Executes every step directly in the sequencer thread.
+
+    A slow step delays all following steps. This is the default behaviour.
+    """
+
+    def start(self):
+        pass
+
+    def dispatch(self, method, func, *args, periodic=False):
+        func(method, *args)
+
+    def shutdown(self):
+        pass
+
+
+class PoolDispatcher(object):
+    """Executes the steps in a bounded pool of worker threads.
+
+    The sequencer thread only hands the steps over to the pool, so a slow
+    step does not delay the steps scheduled after it.
+
+    The number of concurrent calls of the same method expression of a
+    periodic step is limited by method_limit (default 1), that is a periodic
+    reader never overlaps with itself. If the limit is reached, the periodic
+    step is skipped and a warning is logged. The limit can be overridden per
+    method with method_limits, a value of None means unlimited. Single steps
+    are never skipped, they are queued and called exactly once.
+
+    If timeout is set, a step which is not finished after that many seconds
+    is reported by a watchdog thread. A step which did not start yet is
+    cancelled, a running step cannot be interrupted and keeps its slot until
+    it returns. Per method timeouts can be given with method_timeouts.
+    """
+
+    def __init__(self, max_workers=None, method_limit=1, method_limits=None,
+                 timeout=None, method_timeouts=None):
+        self.max_workers = max_workers
+        self.method_limit = method_limit
+        self.method_limits = dict(method_limits or {})
+        self.timeout = timeout
+        self.method_timeouts = dict(method_timeouts or {})
+        self.executor = None
+        self.lock = threading.Lock()
+        self.running = dict()
+        self.pending = list()
+        self.skipped = 0
+        self.timed_out = 0
+        self.watchdog = None
+        self.wakeup = threading.Event()
+        self.closing = False
+
+    def start(self):
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                           thread_name_prefix='qseq-step')
+        self.closing = False
+        if self.timeout is not None or self.method_timeouts:
+            self.watchdog = threading.Thread(target=self._watchdog,
+                                             daemon=True,
+                                             name='qseq-watchdog')
+            self.watchdog.start()
+
+    def _done(self, method):
+        with self.lock:
+            self.running[method] -= 1
+
+    def _check_timeouts(self):
+        now = time.monotonic()
+        with self.lock:
+            expired = list()
+            pending = list()
+            for (deadline, future, method) in self.pending:
+                if future.done():
+                    continue
+                if now >= deadline:
+                    expired.append((future, method))
+                else:
+                    pending.append((deadline, future, method))
+            self.pending = pending
+            self.timed_out += len(expired)
+        # cancelling calls the done callback, which takes the lock
+        for (future, method) in expired:
+            if future.cancel():
+                logger.error('Step %s timed out before it was started',
+                             method)
+            else:
+                logger.error('Step %s is still running after its timeout',
+                             method)
+
+    def _watchdog(self):
+        while not self.closing:
+            with self.lock:
+                deadline = min((d for (d, f, m) in self.pending),
+                               default=None)
+            if deadline is not None:
+                deadline = max(0, deadline - time.monotonic())
+            self.wakeup.wait(deadline)
+            self.wakeup.clear()
+            self._check_timeouts()
+
+    def dispatch(self, method, func, *args, periodic=False):
+        limit = self.method_limits.get(method, self.method_limit)
+        with self.lock:
+            count = self.running.get(method, 0)
+            if periodic and limit is not None and count >= limit:
+                self.skipped += 1
+                logger.warning('Skipping %s, %d call(s) are still running',
+                               method, count)
+                return
+            self.running[method] = count + 1
+
+        future = self.executor.submit(func, method, *args)
+        future.add_done_callback(lambda f: self._done(method))
+
+        timeout = self.method_timeouts.get(method, self.timeout)
+        if timeout is not None:
+            with self.lock:
+                self.pending.append((time.monotonic() + timeout, future,
+                                     method))
+            self.wakeup.set()
+
+    def shutdown(self):
+        """Waits for all dispatched steps, the watchdog reports timeouts
+        meanwhile."""
+        self.executor.shutdown(wait=True)
+        if self.watchdog is not None:
+            self.closing = True
+            self.wakeup.set()
+            self.watchdog.join()
+            self.watchdog = None
+
+        if self.skipped:
+            logger.warning('%d step(s) skipped because the previous call was '
+                           'still running', self.skipped)
+        if self.timed_out:
+            logger.warning('%d step(s) timed out', self.timed_out)
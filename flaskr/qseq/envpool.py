@@ -0,0 +1,111 @@
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .sequencer import IsolatedEnvironment, QSEQ_LOG
+from .timestamp import QSEQ_START_TIMESTAMP, QSEQ_TIMESTAMP
+
+logger = logging.getLogger(__name__)
+
+
+def _resource_key(resources):
+    """Returns a key which changes whenever one of the resource files
+    changes."""
+    key = list()
+    for resource in resources:
+        try:
+            st = os.stat(resource)
+            key.append((resource, st.st_mtime_ns, st.st_size))
+        except OSError:
+            key.append((resource, None, None))
+    return tuple(key)
+
+
+class EnvironmentPool(object):
+    """Keeps prewarmed environments with loaded resource scripts.
+
+    For every set of resource files up to size environments are prepared in
+    a background thread, environments which are still being prepared count
+    as well, so repeated prewarm() calls do not queue more builds.
+    acquire() hands out a prepared environment and prepares a replacement,
+    thus the next run of the same sequence does not wait for its resource
+    scripts. Every environment is used by one run only, so runs do not share
+    globals. Environments of changed resource files are discarded.
+
+    The environments are prepared with the defaults of the sequencer globals
+    (qseq_log, qseq_timestamp, ...), the sequencer injects its own values
+    again when it is started.
+    """
+
+    def __init__(self, size=1, script_cache=None):
+        self.size = size
+        self.script_cache = script_cache
+        self.lock = threading.Lock()
+        self.spares = dict()
+        # the number of queued or running builds per resource key
+        self.pending = dict()
+        self.executor = ThreadPoolExecutor(max_workers=1,
+                                           thread_name_prefix='qseq-envpool')
+
+    def _build(self, resources):
+        env = IsolatedEnvironment()
+        env.inject_global('qseq_start_timestamp', QSEQ_START_TIMESTAMP)
+        env.inject_global('qseq_timestamp', QSEQ_TIMESTAMP)
+        env.inject_global('qseq_time', time.time)
+        env.inject_global('qseq_sleep', time.sleep)
+        env.inject_global('qseq_log', QSEQ_LOG)
+        for resource in resources:
+            logger.debug('Prewarming resource %s', resource)
+            env.load_script(resource, self.script_cache)
+        return env
+
+    def _prewarm(self, resources, key):
+        env = None
+        try:
+            env = self._build(resources)
+        except Exception:
+            logger.exception('Failed to prewarm %s', ', '.join(resources))
+        with self.lock:
+            self.pending[key] -= 1
+            if not self.pending[key]:
+                del self.pending[key]
+            if env is None:
+                return
+            spares = self.spares.setdefault(key, list())
+            if len(spares) < self.size:
+                spares.append(env)
+
+    def prewarm(self, resources):
+        """Prepares environments for the resource files in the
+        background."""
+        resources = tuple(resources)
+        key = _resource_key(resources)
+        with self.lock:
+            missing = self.size - len(self.spares.get(key, ())) - \
+                self.pending.get(key, 0)
+            if missing > 0:
+                self.pending[key] = self.pending.get(key, 0) + missing
+        for i in range(missing):
+            self.executor.submit(self._prewarm, resources, key)
+
+    def acquire(self, resources):
+        """Returns an environment with the resource files loaded, prewarmed
+        if available, and prepares a replacement."""
+        resources = tuple(resources)
+        key = _resource_key(resources)
+        with self.lock:
+            # drop the environments of changed resource files
+            for stale in [k for k in self.spares if k != key and
+                          tuple(r for (r, m, s) in k) == resources]:
+                del self.spares[stale]
+            spares = self.spares.get(key)
+            env = spares.pop() if spares else None
+        if env is None:
+            env = self._build(resources)
+        self.prewarm(resources)
+        return env
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
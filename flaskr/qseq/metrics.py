@@ -0,0 +1,163 @@
+import threading
+
+from .timing import LatencyHistogram
+
+
+class MethodMetrics(object):
+    """The metrics of one method expression."""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        # periodic steps dropped by the overrun policy, by policy
+        self.overruns = dict()
+        self.duration = LatencyHistogram()
+        self.lateness = LatencyHistogram()
+
+    def summary(self):
+        return dict(calls=self.calls, errors=self.errors,
+                    overruns=dict(self.overruns),
+                    duration=self.duration.summary(),
+                    lateness=self.lateness.summary())
+
+
+class StepMetrics(object):
+    """Collects execution metrics per method expression of a sequence.
+
+    For every distinct method the number of calls, the number of exceptions,
+    a histogram of the evaluation time and a histogram of the start lateness
+    are recorded. The memory usage only depends on the number of distinct
+    methods, not on the number of steps. Recording is thread-safe, so steps
+    may run in worker threads.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.methods = dict()
+
+    def _get(self, method):
+        metrics = self.methods.get(method)
+        if metrics is None:
+            metrics = self.methods[method] = MethodMetrics()
+        return metrics
+
+    def record_lateness(self, method, lateness):
+        with self.lock:
+            self._get(method).lateness.record(lateness)
+
+    def record(self, method, duration, error=None):
+        with self.lock:
+            metrics = self._get(method)
+            metrics.calls += 1
+            if error is not None:
+                metrics.errors += 1
+            metrics.duration.record(duration)
+
+    def record_overrun(self, method, policy):
+        """Counts a periodic step which was dropped by the overrun policy
+        ('skip' or 'coalesce')."""
+        with self.lock:
+            overruns = self._get(method).overruns
+            overruns[policy] = overruns.get(policy, 0) + 1
+
+    def summary(self):
+        """Returns a dict mapping the methods to their call, error and
+        overrun counts and the duration and lateness summaries."""
+        with self.lock:
+            return dict((method, metrics.summary())
+                        for (method, metrics) in self.methods.items())
+
+    def format_summary(self):
+        """Returns a table of the methods, the most expensive first."""
+        with self.lock:
+            items = sorted(self.methods.items(),
+                           key=lambda item: item[1].duration.total,
+                           reverse=True)
+            lines = ['%-40s %8s %6s %8s %10s %10s %10s %10s' % (
+                'METHOD', 'CALLS', 'ERRORS', 'DROPPED', 'TOTAL s', 'MEAN ms',
+                'P99 ms', 'LATE99 ms')]
+            for (method, metrics) in items:
+                d = metrics.duration
+                row = (method, metrics.calls, metrics.errors,
+                       sum(metrics.overruns.values()), d.total,
+                       (d.mean() or 0.0) * 1e3,
+                       (d.percentile(99) or 0.0) * 1e3,
+                       (metrics.lateness.percentile(99) or 0.0) * 1e3)
+                lines.append('%-40s %8d %6d %8d %10.3f %10.3f %10.3f '
+                             '%10.3f' % row)
+        return '\n'.join(lines)
+
+
+# quantiles exported for the summaries
+PROMETHEUS_QUANTILES = (0.5, 0.9, 0.99)
+
+
+def _format_labels(labels):
+    items = list()
+    for (name, value) in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"')
+        value = value.replace('\n', '\\n')
+        items.append('%s="%s"' % (name, value))
+    return '{%s}' % ','.join(items)
+
+
+def format_prometheus(sources):
+    """Returns the metrics in the Prometheus text exposition format.
+
+    sources is a list of (labels, StepMetrics) tuples, where labels is a
+    dict of labels added to every sample of the metrics, e.g. the sequence
+    file. The method is added as label 'method'.
+    """
+    calls = list()
+    errors = list()
+    overruns = list()
+    durations = list()
+    lateness = list()
+    for (labels, metrics) in sources:
+        with metrics.lock:
+            for (method, m) in sorted(metrics.methods.items()):
+                base = sorted(labels.items()) + [('method', method)]
+                calls.append('qseq_step_calls_total%s %d' % (
+                    _format_labels(base), m.calls))
+                errors.append('qseq_step_errors_total%s %d' % (
+                    _format_labels(base), m.errors))
+                for (policy, count) in sorted(m.overruns.items()):
+                    overruns.append('qseq_step_overruns_total%s %d' % (
+                        _format_labels(base + [('policy', policy)]), count))
+                for (samples, name, histogram) in (
+                        (durations, 'qseq_step_duration_seconds',
+                         m.duration),
+                        (lateness, 'qseq_step_lateness_seconds',
+                         m.lateness)):
+                    if histogram.count == 0:
+                        continue
+                    for q in PROMETHEUS_QUANTILES:
+                        samples.append('%s%s %r' % (
+                            name,
+                            _format_labels(base + [('quantile', '%g' % q)]),
+                            histogram.percentile(q * 100)))
+                    samples.append('%s_sum%s %r' % (
+                        name, _format_labels(base), histogram.total))
+                    samples.append('%s_count%s %d' % (
+                        name, _format_labels(base), histogram.count))
+
+    lines = ['# HELP qseq_step_calls_total Number of evaluated steps.',
+             '# TYPE qseq_step_calls_total counter']
+    lines.extend(calls)
+    lines.extend(['# HELP qseq_step_errors_total Number of steps which '
+                  'raised an exception.',
+                  '# TYPE qseq_step_errors_total counter'])
+    lines.extend(errors)
+    lines.extend(['# HELP qseq_step_overruns_total Number of periodic steps '
+                  'dropped by the overrun policy.',
+                  '# TYPE qseq_step_overruns_total counter'])
+    lines.extend(overruns)
+    lines.extend(['# HELP qseq_step_duration_seconds Evaluation time of the '
+                  'steps.',
+                  '# TYPE qseq_step_duration_seconds summary'])
+    lines.extend(durations)
+    lines.extend(['# HELP qseq_step_lateness_seconds Delay between the '
+                  'scheduled and the actual start of the steps.',
+                  '# TYPE qseq_step_lateness_seconds summary'])
+    lines.extend(lateness)
+    return '\n'.join(lines) + '\n'
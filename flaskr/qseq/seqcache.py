@@ -0,0 +1,271 @@
+import os
+import glob
+import array
+import pickle
+import marshal
+import hashlib
+import logging
+import tempfile
+import importlib.util
+
+logger = logging.getLogger(__name__)
+
+# increase whenever the format of the cached data changes
+CACHE_VERSION = 1
+
+
+def default_cache_dir():
+    """Returns $QSEQ_CACHE_DIR or the qseq directory in the user cache."""
+    directory = os.environ.get('QSEQ_CACHE_DIR')
+    if directory:
+        return directory
+    base = os.environ.get('XDG_CACHE_HOME',
+                          os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'qseq')
+
+
+def file_hash(filename):
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def file_signature(filename):
+    """Returns (mtime_ns, size, sha256) of a file or None if it does not
+    exist."""
+    try:
+        st = os.stat(filename)
+        return (st.st_mtime_ns, st.st_size, file_hash(filename))
+    except OSError:
+        return None
+
+
+def _signature_matches(filename, signature):
+    """Checks a file against a stored signature.
+
+    If modification time and size are unchanged, the file is assumed to be
+    unchanged. Otherwise the content hash decides.
+    """
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return signature is None
+    if signature is None:
+        return False
+    (mtime_ns, size, digest) = signature
+    if st.st_mtime_ns == mtime_ns and st.st_size == size:
+        return True
+    return st.st_size == size and file_hash(filename) == digest
+
+
+def _write_atomic(directory, filename, data):
+    """Writes data to filename in directory via a temporary file, so readers
+    never see a partially written file."""
+    try:
+        os.makedirs(directory, exist_ok=True)
+        fd, tmpname = tempfile.mkstemp(dir=directory)
+    except OSError:
+        logger.warning('Could not write cache file %s', filename,
+                       exc_info=True)
+        return
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmpname, filename)
+    except OSError:
+        logger.warning('Could not write cache file %s', filename,
+                       exc_info=True)
+        os.unlink(tmpname)
+
+
+class PackedSchedule(object):
+    """A read-only list of SequenceStep tuples backed by compact arrays.
+
+    The timestamps are stored in an array of doubles and the methods as
+    indices into a method table. The SequenceStep tuples are only created
+    when they are accessed, so loading a huge schedule from the cache does
+    not allocate millions of objects upfront.
+    """
+
+    def __init__(self, timestamps, indices, methods, step_class):
+        self.timestamps = timestamps
+        self.indices = indices
+        self.methods = methods
+        self.step_class = step_class
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def _step(self, i):
+        return self.step_class(self.timestamps[i],
+                               self.methods[self.indices[i]])
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._step(j) for j in range(*i.indices(len(self)))]
+        return self._step(i)
+
+    def __iter__(self):
+        return map(self.step_class._make,
+                   zip(self.timestamps,
+                       map(self.methods.__getitem__, self.indices)))
+
+
+def pack_schedule(schedule):
+    """Converts a list of SequenceStep into a compact form, that is an array
+    of timestamps, an array of indices into a method table and the method
+    table itself."""
+    if isinstance(schedule, PackedSchedule):
+        return (schedule.timestamps, schedule.indices, schedule.methods)
+    methods = dict()
+    timestamps = array.array('d')
+    indices = array.array('I')
+    for step in schedule:
+        timestamps.append(step.timestamp)
+        indices.append(methods.setdefault(step.method, len(methods)))
+    return (timestamps, indices, list(methods))
+
+
+class SequenceCache(object):
+    """An on-disk cache of parsed sequence files.
+
+    For every sequence file the parsed input lines and, if available, the
+    computed schedule are stored in a binary file in the cache directory.
+    The entry is keyed by the absolute path of the sequence file and is
+    validated against the modification time and the content hash of the
+    sequence file and of all its resource files ('l' commands). Resource
+    files are resolved relative to the current directory, like the sequencer
+    does when loading them. There is one entry per sequence file, it is
+    replaced when the file changes. Entries of deleted sequence files are
+    never removed, the cache directory can be cleared at any time.
+    """
+
+    def __init__(self, directory=None):
+        if directory is None:
+            directory = default_cache_dir()
+        self.directory = directory
+
+    def _entry_filename(self, filename):
+        key = hashlib.sha256(os.path.abspath(filename).encode()).hexdigest()
+        return os.path.join(self.directory, key + '.qsc')
+
+    def signature(self, filename):
+        """Returns the signature of a sequence file, take it before parsing
+        the file and pass it to store()."""
+        return file_signature(filename)
+
+    def load(self, filename, step_class):
+        """Returns (lines, schedule, signature) for a sequence file or None
+        if there is no valid cache entry.
+
+        The schedule is a PackedSchedule of step_class tuples or None if it
+        was not stored. The signature is the one of the cached lines.
+        """
+        try:
+            with open(self._entry_filename(filename), 'rb') as f:
+                entry = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            logger.warning('Ignoring broken cache entry for %s', filename)
+            return None
+
+        if entry.get('version') != CACHE_VERSION:
+            return None
+        if not _signature_matches(filename, entry['signature']):
+            return None
+        for (resource, signature) in entry['resources']:
+            if not _signature_matches(resource, signature):
+                return None
+
+        logger.debug('Using cached sequence %s', filename)
+        schedule = entry['schedule']
+        if schedule is not None:
+            schedule = PackedSchedule(*schedule, step_class=step_class)
+        return (entry['lines'], schedule, entry['signature'])
+
+    def store(self, filename, lines, resources, schedule=None,
+              signature=None):
+        """Stores the parsed lines, the resource files and optionally the
+        computed schedule of a sequence file.
+
+        signature is the signature of the file the lines were parsed from,
+        see signature(). If the file was changed since, e.g. while a large
+        file was parsed, nothing is stored, because the entry would be
+        valid for the new content.
+        """
+        if signature is None:
+            signature = file_signature(filename)
+        elif not _signature_matches(filename, signature):
+            logger.debug('Not caching %s, it was changed while loading',
+                         filename)
+            return
+        if schedule is not None:
+            schedule = pack_schedule(schedule)
+        entry = dict(version=CACHE_VERSION,
+                     signature=signature,
+                     resources=[(os.path.abspath(r), file_signature(r))
+                                for r in resources],
+                     lines=[tuple(line) for line in lines],
+                     schedule=schedule)
+
+        _write_atomic(self.directory, self._entry_filename(filename),
+                      pickle.dumps(entry, pickle.HIGHEST_PROTOCOL))
+
+
+class ScriptCache(object):
+    """An on-disk cache of the compiled code of resource scripts.
+
+    The code objects are stored with marshal, like the .pyc files of Python.
+    An entry is keyed by the hash of the script path and the hash of the
+    script source and the bytecode version of the interpreter, thus a
+    changed script or another Python version never uses a stale entry. When
+    a new entry is stored, the other entries of the same path are removed.
+    """
+
+    def __init__(self, directory=None):
+        if directory is None:
+            directory = default_cache_dir()
+        self.directory = directory
+
+    def _path_key(self, filename):
+        return hashlib.sha256(os.path.abspath(filename).encode()).hexdigest()
+
+    def _entry_filename(self, filename, source):
+        h = hashlib.sha256(importlib.util.MAGIC_NUMBER)
+        h.update(source)
+        return os.path.join(self.directory, '%s-%s.qbc' % (
+            self._path_key(filename), h.hexdigest()))
+
+    def _prune(self, filename, entry):
+        """Removes the stale entries of a script."""
+        pattern = os.path.join(self.directory,
+                               self._path_key(filename) + '-*.qbc')
+        for stale in glob.glob(pattern):
+            if stale == entry:
+                continue
+            try:
+                os.unlink(stale)
+            except OSError:
+                pass
+
+    def compile(self, filename):
+        """Returns the code object of a script, compiled or from the
+        cache."""
+        with open(filename, 'rb') as f:
+            source = f.read()
+        entry = self._entry_filename(filename, source)
+        try:
+            with open(entry, 'rb') as f:
+                return marshal.load(f)
+        except FileNotFoundError:
+            pass
+        except Exception:
+            logger.warning('Ignoring broken cache entry for %s', filename)
+
+        code = compile(source, filename, 'exec')
+        _write_atomic(self.directory, entry, marshal.dumps(code))
+        self._prune(filename, entry)
+        return code
@@ -1,10 +1,16 @@
+import os
 import time
+import heapq
+import threading
 import logging
-from collections import namedtuple
+from collections import namedtuple, Counter
 
-from .common import frange
+from .common import grid_index, grid_blocks
 from .csvlog import CsvLog
-from .timestamp import QSEQ_START_TIMESTAMP, QSEQ_TIMESTAMP
+from .timestamp import QSEQ_START_TIMESTAMP, QSEQ_TIMESTAMP, set_clock
+from .timing import MonotonicTimer
+from .metrics import StepMetrics
+from .dispatch import InlineDispatcher
 
 logger = logging.getLogger(__name__)
 
@@ -21,6 +27,13 @@ class ParseError(Exception):
                                       self.lineno)
 
 
+def format_error(error):
+    """Returns the message of an exception prefixed with its class name."""
+    if isinstance(error, ParseError):
+        # already prefixed
+        return str(error)
+    return '%s: %s' % (error.__class__.__name__, error)
+
 CMD_INIT = 0
 CMD_FINI = 1
 CMD_PERIODIC = 2
@@ -29,17 +42,34 @@ CMD_LOAD_RESOURCES = 4
 CMD_REPEAT_BEGIN = 5
 CMD_REPEAT_END = 6
 
-SequencerInputLine = namedtuple("SequencerInputLine", "cmd data")
+# what to do with periodic steps which are missed because the sequencer fell
+# behind: run all of them late, run only the latest one or skip them and
+# continue with the next slot in the future
+OVERRUN_CATCH_UP = 'catch_up'
+OVERRUN_COALESCE = 'coalesce'
+OVERRUN_SKIP = 'skip'
+
+OVERRUN_POLICIES = (OVERRUN_CATCH_UP, OVERRUN_COALESCE, OVERRUN_SKIP)
+
+SequencerInputLine = namedtuple("SequencerInputLine", "cmd data lineno",
+                                defaults=(None,))
 
 
 class SequenceFileParser(object):
-    def __init__(self, filename=None):
+    """Parses a sequence file into SequencerInputLine tuples.
+
+    If a filename is given, the whole file is parsed and the lines are stored
+    in the lines attribute. For very large files use iter_lines() instead,
+    which reads the file incrementally and yields the parsed lines.
+    """
+
+    def __init__(self, filename=None, lazy=False):
         self.filename = filename
         self.lines = list()
         self.repeat_depth = 0
         self.line = None
         self.lineno = None
-        if self.filename is not None:
+        if self.filename is not None and not lazy:
             self.parse_input()
 
     def _convert_float(self, x):
@@ -49,7 +79,18 @@ class SequenceFileParser(object):
             raise ParseError('Could not convert to float', self.lineno,
                              self.line)
 
+    def _split(self, line, maxsplit):
+        items = line.split(None, maxsplit)
+        if len(items) <= maxsplit:
+            raise ParseError('Missing argument', self.lineno, self.line)
+        return items
+
+    def _make(self, cmd, data):
+        return SequencerInputLine(cmd, data, self.lineno)
+
     def _parse_line(self):
+        """Parses the current line, returns a SequencerInputLine or None for
+        empty lines."""
         line = self.line
         lineno = self.lineno
 
@@ -63,63 +104,83 @@ class SequenceFileParser(object):
 
         # (3) ignore empty lines
         if len(line) == 0:
-            return
+            return None
 
         if line[0] == 'R':
             cmd, line = ('R', None)
         else:
-            cmd, line = line.split(None, 1)
+            cmd, line = self._split(line, 1)
 
         if cmd == 'i':
             cmd = CMD_INIT
-            self.lines.append(SequencerInputLine(cmd, line))
+            return self._make(cmd, line)
         elif cmd == 'f':
             cmd = CMD_FINI
-            self.lines.append(SequencerInputLine(cmd, line))
+            return self._make(cmd, line)
         elif cmd == 'p':
             cmd = CMD_PERIODIC
-            delay, method = line.split(None, 1)
+            delay, method = self._split(line, 1)
             delay = self._convert_float(delay)
-            self.lines.append(SequencerInputLine(cmd, (delay, 0, method)))
+            return self._make(cmd, (delay, 0, method))
         elif cmd == 'P':
             cmd = CMD_PERIODIC
-            delay, offset, method = line.split(None, 2)
+            delay, offset, method = self._split(line, 2)
             delay = self._convert_float(delay)
             offset = self._convert_float(offset)
             if (abs(offset) >= delay):
-                raise RuntimeError('offset is greater than delay for periodic'
-                                   ' command')
-            self.lines.append(SequencerInputLine(cmd, (delay, offset, method)))
+                raise ParseError('offset is greater than delay for periodic'
+                                 ' command', lineno, self.line)
+            return self._make(cmd, (delay, offset, method))
         elif cmd == 's':
             cmd = CMD_SINGLE
-            delay, method = line.split(None, 1)
+            delay, method = self._split(line, 1)
             delay = self._convert_float(delay)
-            self.lines.append(SequencerInputLine(cmd, (delay, method)))
+            return self._make(cmd, (delay, method))
         elif cmd == 'l':
             cmd = CMD_LOAD_RESOURCES
-            self.lines.append(SequencerInputLine(cmd, line))
+            return self._make(cmd, line)
         elif cmd == 'r':
             cmd = CMD_REPEAT_BEGIN
             repeat_count = self._convert_float(line)
-            self.lines.append(SequencerInputLine(cmd, repeat_count))
-            self.repeat_depth += 1
+            return self._make(cmd, repeat_count)
         elif cmd == 'R':
             cmd = CMD_REPEAT_END
-            self.lines.append(SequencerInputLine(cmd, None))
-            self.repeat_depth -= 1
-            if self.repeat_depth < 0:
-                raise ParseError('Repeat end without begin', lineno, line)
+            return self._make(cmd, None)
+        return None
 
-    def parse_input(self):
+    def iter_lines(self):
+        """Reads the file line by line and yields the parsed lines.
+
+        Only the line numbers of the open repeat blocks are kept, thus the
+        memory usage does not depend on the size of the file. Unbalanced
+        repeat blocks are reported with the line number of the offending
+        'r' or 'R' command.
+        """
+        repeat_begins = list()
+        self.repeat_depth = 0
         with open(self.filename) as f:
-            for lineno, line in enumerate(f.readlines(), 1):
+            for lineno, line in enumerate(f, 1):
                 self.line = line
                 self.lineno = lineno
-                self._parse_line()
+                parsed = self._parse_line()
+                if parsed is None:
+                    continue
+                if parsed.cmd == CMD_REPEAT_BEGIN:
+                    repeat_begins.append(lineno)
+                elif parsed.cmd == CMD_REPEAT_END:
+                    if not repeat_begins:
+                        raise ParseError('Repeat end without begin', lineno,
+                                         line)
+                    repeat_begins.pop()
+                self.repeat_depth = len(repeat_begins)
+                yield parsed
 
-        # XXX: move to parser and fix line number
-        if self.repeat_depth > 0:
-            raise ParseError('Repeat begin without end', -1, None)
+        if repeat_begins:
+            raise ParseError('Repeat begin without end', repeat_begins[-1],
+                             None)
+
+    def parse_input(self):
+        self.lines.extend(self.iter_lines())
 
 
 SequenceStep = namedtuple("SequenceStep", "timestamp method")
@@ -134,24 +195,99 @@ class IsolatedEnvironment(object):
 
     def __init__(self):
         self.globals = dict()
+        self.code_cache = dict()
 
     def inject_global(self, name, value):
         self.globals[name] = value
 
-    def load_script(self, filename):
-        with open(filename) as f:
-            script = f.read()
-            code = compile(script, filename, 'exec')
-            eval(code, self.globals, self.globals)
+    def load_script(self, filename, cache=None):
+        """Executes a script in the environment. If a ScriptCache is given,
+        the compiled code is taken from it."""
+        if cache is not None:
+            code = cache.compile(filename)
+        else:
+            with open(filename) as f:
+                script = f.read()
+                code = compile(script, filename, 'exec')
+        eval(code, self.globals, self.globals)
+
+    def compile(self, expression, cache=True):
+        """Compiles an expression and caches the code object.
+
+        Every distinct expression is compiled only once, later calls and
+        evaluate() reuse the cached code object. If cache is False, the
+        expression is only checked and the code object is not stored. A
+        SyntaxError is raised for invalid expressions.
+        """
+        code = self.code_cache.get(expression)
+        if code is None:
+            code = compile(expression, '<qseq>', 'eval')
+            if cache:
+                self.code_cache[expression] = code
+        return code
 
     def evaluate(self, expression):
-        ret = eval(expression, self.globals, self.globals)
+        """Evaluates an expression. Expressions which were not compiled with
+        compile() before are compiled on every call."""
+        code = self.code_cache.get(expression)
+        if code is None:
+            code = compile(expression, '<qseq>', 'eval')
+        ret = eval(code, self.globals, self.globals)
         if callable(ret):
             logger.warning("Returned object is callable. "
                            "Forgot function call?")
         return ret
 
 
+class RepeatBlock(object):
+    """A block of commands which is executed count times.
+
+    The steps list holds the single steps as (order, delay, method) tuples
+    and the nested blocks in the order of the input file. The periodic
+    commands of a block are executed during every iteration of the block.
+    The duration is the run time of one iteration.
+    """
+
+    def __init__(self, count=1, lineno=None):
+        self.count = count
+        self.lineno = lineno
+        self.steps = list()
+        self.periodics = list()
+        self.duration = 0.0
+
+    def add_single(self, order, delay, method):
+        self.steps.append((order, delay, method))
+        self.duration += delay
+
+    def add_block(self, block):
+        self.steps.append(block)
+        self.duration += block.count * block.duration
+
+
+class StreamedSteps(object):
+    """The top-level steps of a sequence file, which are read from the file
+    on every iteration.
+
+    It is used instead of the steps list of the top-level RepeatBlock in
+    streaming mode and yields the same items, that is single steps and
+    complete nested blocks. Only one repeat block at a time is held in
+    memory.
+    """
+
+    def __init__(self, sequencer, filename):
+        self.sequencer = sequencer
+        self.filename = filename
+
+    def __iter__(self):
+        parser = SequenceFileParser(self.filename, lazy=True)
+        lines = enumerate(parser.iter_lines())
+        for (order, item) in self.sequencer._group_lines(lines):
+            if isinstance(item, RepeatBlock):
+                yield item
+            elif item.cmd == CMD_SINGLE:
+                yield (order,) + tuple(item.data)
+
+
 class Sequencer(object):
     """The sequencer class parses a sequence file and executes it.
 
@@ -168,7 +304,52 @@ class Sequencer(object):
     computed. Then, the single step commands are just inserted at the right
     timestamp and periodic commands are inserted multiple times until the
     schedule is finished, that is the complete run time is over. Once the
-    schedule is computed, it is executed step by step.
+    schedule is computed, it is executed step by step. The steps are
+    generated while running, the schedule attribute, a list of all steps, is
+    only built when it is accessed, e.g. to display it.
+
+    Commands between 'r N' and 'R' form a repeat block, which is executed N
+    times. Blocks may be nested. The run time of a block is N times the run
+    time of its single steps, periodic commands inside a block are executed
+    during every iteration of the block, but never later than the end of the
+    iteration. Repeat blocks are never copied, instead the steps of each
+    iteration are generated with a time offset.
+
+    If streaming is True, the schedule is never materialized. Instead, every
+    command is turned into a timestamp generator and the generators are merged
+    while the sequence is running. This keeps the memory usage constant, no
+    matter how long the run time is. The schedule attribute stays empty in
+    this mode, use iter_schedule() to inspect the steps. When a sequence
+    file is loaded in streaming mode, the single steps and repeat blocks are
+    read from the file while running, thus also huge generated sequence
+    files need only as much memory as their largest repeat block.
+
+    The timer decides how the sequencer waits for the next step, see
+    MonotonicTimer and HybridTimer in the timing module. It also records how
+    late every step was started. With a VirtualTimer the sequence is
+    simulated: the steps are executed without waiting, while qseq_time(),
+    qseq_sleep() and qseq_timestamp() follow the virtual clock. Resource
+    scripts have to use these instead of the time module to be simulated.
+    The dispatcher decides where the steps are
+    executed, either directly in the sequencer thread (InlineDispatcher) or
+    in a pool of worker threads (PoolDispatcher), see the dispatch module.
+    The log is available as qseq_log in the resource scripts, by default the
+    shared CsvLog writing to stdout. It is flushed at the end of the run.
+    The call counts, evaluation times, start lateness and exceptions of
+    every method are collected in metrics, see StepMetrics. If a
+    ScriptCache is given, the compiled code of the resource scripts is
+    cached on disk.
+
+    With hot_reload the sequence file is checked for changes every
+    reload_interval seconds by a background thread while running, so parsing
+    it does not delay the steps. On a change the single and
+    periodic steps which are still ahead are rescheduled from the new file,
+    while the elapsed timeline is kept: steps of unchanged commands continue
+    where they are, steps of added commands start at the time of the reload
+    and steps of removed commands are dropped. Single steps are matched by
+    their method: a method which already ran n times as a single step is not
+    run again by its first n single steps after the reload, even if they
+    moved to a later time or their delay was changed.
 
     Supported commands:
      - 'l file.py' loads a python script (function definitions)
@@ -178,43 +359,315 @@ class Sequencer(object):
      - 'p 5 method()' periodic, method() is called every 5 seconds
      - 'P 5 1 method()' periodic, method() is called every 5 seconds beginning
        with time t=1, eg. t=1, t=6, t=11, etc
+     - 'r 10' begins a block which is repeated 10 times
+     - 'R' ends a repeat block
     """
 
-    def __init__(self):
+    def __init__(self, streaming=False, timer=None, dispatcher=None,
+                 log=None, script_cache=None, hot_reload=False):
+        if streaming and hot_reload:
+            raise ValueError('Hot reload is not supported in streaming mode')
         self.environment = IsolatedEnvironment()
-        self.schedule = list()
+        self.script_cache = script_cache
+        self.prewarmed = False
+        if log is None:
+            log = QSEQ_LOG
+        self.log = log
+        self.streaming = streaming
+        if timer is None:
+            timer = MonotonicTimer()
+        self.timer = timer
+        if dispatcher is None:
+            dispatcher = InlineDispatcher()
+        self.dispatcher = dispatcher
+        self._schedule = None
         self.initializations = list()
         self.finalizations = list()
         self.resources = list()
+        self.run_time = 0.0
+        self.filename = None
+        self.listeners = list()
+        self.metrics = StepMetrics()
+        self.hot_reload = hot_reload
+        # seconds between two checks of the sequence file
+        self.reload_interval = 1.0
+        self._commands = frozenset()
+        # the latest result of _load_changes() of the watcher thread
+        self._changes = None
+        self._file_signature = None
+        self.overrun_policy = OVERRUN_CATCH_UP
+        self.overrun_policies = dict()
+        self._periods = dict()
+        self._root = RepeatBlock()
+
+    def add_listener(self, listener):
+        """Registers a function which is called for every run and step event.
+
+        The listener is called as listener(event, data) where event is one of
+        'run_start', 'run_end', 'run_reload', 'step_start', 'step_end' and
+        'step_error' and data is a dict. Step events contain the index of the
+        step in the schedule, its timestamp and method, 'step_end' and
+        'step_error' also the duration in seconds and 'step_error' the error
+        message. Step events may be emitted from worker threads.
+        """
+        self.listeners.append(listener)
+
+    def _notify(self, event, data):
+        for listener in self.listeners:
+            try:
+                listener(event, data)
+            except Exception:
+                logger.exception('Exception in listener %s', listener)
+
+    def _periodic_last(self, period, offset, duration, clip):
+        # the first step is at offset + period, the last one is the first
+        # which reaches the duration, or the last one within the duration if
+        # clipped. Returns the grid index after the last step.
+        last = grid_index(offset, duration, period) + 1
+        if clip:
+            last = min(last, grid_index(offset, duration, period, True))
+        return last
+
+    def _periodic_steps(self, order, period, offset, method, base, duration,
+                        clip, start=None):
+        # the timestamps are computed from their index on the grid, thus
+        # they do not drift. If start is given, the grid is entered right
+        # before it instead of at its beginning, rounding may leave one step
+        # before start.
+        first = 1
+        if start is not None:
+            first = max(1, grid_index(offset, start - base, period, True) - 1)
+        last = self._periodic_last(period, offset, duration, clip)
+        for block in grid_blocks(offset, period, first, last):
+            for ts in block:
+                yield (base + ts, order, method)
+
+    def _sequential_steps(self, block, base, start=None):
+        ts = base
+        for step in block.steps:
+            if isinstance(step, RepeatBlock):
+                yield from self._block_steps(step, ts, start)
+                ts += step.count * step.duration
+            else:
+                (order, delay, method) = step
+                ts += delay
+                yield (ts, order, method)
 
-    def _parse_input_lines(self, lines):
-        # first calculate complete run time
-        run_time = 0.0
+    def _block_steps(self, block, base, start=None):
+        # periodic steps of nested blocks must not exceed the iteration,
+        # otherwise they would overtake the steps which follow it. If start
+        # is given, periodic steps before it may be left out, single steps
+        # are always generated.
+        clip = block is not self._root
+        for i in range(block.count):
+            iteration_base = base + i * block.duration
+            streams = [self._sequential_steps(block, iteration_base, start)]
+            for (order, (period, offset, method)) in block.periodics:
+                streams.append(self._periodic_steps(order, period, offset,
+                                                    method, iteration_base,
+                                                    block.duration, clip,
+                                                    start))
+            yield from heapq.merge(*streams)
+
+    def _iter_steps(self):
+        """Returns a lazy iterator over (timestamp, order, method) tuples.
+
+        Every single and periodic command is its own timestamp generator. The
+        generators are merged on the fly, so only one pending step per command
+        is held in memory. Repeat blocks are iterated with a time offset, thus
+        they need the same memory as a single iteration. The order is the
+        index of the input line and breaks ties between steps with the same
+        timestamp.
+        """
+        return self._block_steps(self._root, 0.0)
+
+    @property
+    def schedule(self):
+        """The list of all SequenceStep tuples, built on first access. It is
+        empty in streaming mode."""
+        if self.streaming:
+            return list()
+        if self._schedule is None:
+            self._schedule = list(self.iter_schedule())
+        return self._schedule
+
+    def _count_steps(self, block):
+        clip = block is not self._root
+        count = 0
+        for step in block.steps:
+            if isinstance(step, RepeatBlock):
+                count += self._count_steps(step)
+            else:
+                count += 1
+        for (order, (period, offset, method)) in block.periodics:
+            count += max(0, self._periodic_last(period, offset,
+                                                block.duration, clip) - 1)
+        return block.count * count
+
+    def step_count(self):
+        """Returns the number of steps of the schedule.
+
+        The steps are counted per command and multiplied with the repeat
+        counts, thus the cost depends on the number of lines, not on the
+        number of steps. In streaming mode the file is read again.
+        """
+        return self._count_steps(self._root)
+
+    def iter_schedule(self):
+        """Returns a lazy iterator over the SequenceStep tuples of the
+        schedule, ordered by timestamp."""
+        for (ts, order, method) in self._iter_steps():
+            yield SequenceStep(ts, method)
+
+    def _compile_line(self, line, cache=True):
+        if line.cmd in (CMD_INIT, CMD_FINI):
+            method = line.data
+        elif line.cmd == CMD_SINGLE:
+            method = line.data[1]
+        elif line.cmd == CMD_PERIODIC:
+            method = line.data[2]
+        else:
+            return
+        try:
+            self.environment.compile(method, cache)
+        except SyntaxError as e:
+            raise ParseError('Invalid expression (%s)' % e.msg,
+                             line.lineno or -1, method)
+
+    def _compile_methods(self, lines):
+        """Compiles every method expression, so syntax errors are reported
+        before the sequence is started."""
         for line in lines:
-            if line.cmd == CMD_SINGLE:
-                run_time += line.data[0]
+            self._compile_line(line)
+
+    def _repeat_count(self, line):
+        count = int(line.data)
+        if count != line.data or count < 0:
+            raise ParseError('Repeat count must be a non-negative integer',
+                             line.lineno or -1, None)
+        return count
+
+    def _group_lines(self, lines, periods=None):
+        """Groups (order, line) pairs into top-level items.
+
+        Single and periodic commands inside of repeat blocks are collected
+        into a RepeatBlock, which is yielded as (order, block) once the block
+        is complete. All other lines are passed through as (order, line).
+        Thus, at most the largest repeat block is held in memory.
 
+        If periods is a dict, the period of every periodic command is stored
+        in it by order.
+        """
+        blocks = list()
+        for (order, line) in lines:
+            if periods is not None and line.cmd == CMD_PERIODIC:
+                periods[order] = line.data[0]
+            if line.cmd == CMD_REPEAT_BEGIN:
+                blocks.append(RepeatBlock(self._repeat_count(line),
+                                          line.lineno))
+            elif line.cmd == CMD_REPEAT_END:
+                if not blocks:
+                    raise ParseError('Repeat end without begin',
+                                     line.lineno or -1, None)
+                block = blocks.pop()
+                if blocks:
+                    blocks[-1].add_block(block)
+                else:
+                    yield (order, block)
+            elif blocks and line.cmd == CMD_SINGLE:
+                blocks[-1].add_single(order, *line.data)
+            elif blocks and line.cmd == CMD_PERIODIC:
+                blocks[-1].periodics.append((order, line.data))
+            else:
+                yield (order, line)
+        if blocks:
+            raise ParseError('Repeat begin without end',
+                             blocks[-1].lineno or -1, None)
+
+    def _add_line(self, line):
+        if line.cmd == CMD_INIT:
+            self.initializations.append(line.data)
+        elif line.cmd == CMD_FINI:
+            self.finalizations.append(line.data)
+        elif line.cmd == CMD_LOAD_RESOURCES:
+            self.resources.append(line.data)
+
+    def _build_root(self, lines):
+        """Returns the top-level RepeatBlock of lines, a list of the init,
+        finalize and load commands and a dict mapping the orders of the
+        periodic commands to their period."""
+        root = RepeatBlock()
+        others = list()
+        periods = dict()
+        for (order, item) in self._group_lines(enumerate(lines), periods):
+            if isinstance(item, RepeatBlock):
+                root.add_block(item)
+            elif item.cmd == CMD_SINGLE:
+                root.add_single(order, *item.data)
+            elif item.cmd == CMD_PERIODIC:
+                root.periodics.append((order, item.data))
+            else:
+                others.append(item)
+        return (root, others, periods)
+
+    def _step_commands(self, lines):
+        """Returns the set of single and periodic commands of lines, used to
+        find the commands which were added by a reload."""
+        return frozenset((line.cmd, tuple(line.data)) for line in lines
+                         if line.cmd in (CMD_SINGLE, CMD_PERIODIC))
+
+    def _parse_input_lines(self, lines, schedule=None):
         # add methods, includes, etc
-        ts = 0.0
-        for line in lines:
-            if line.cmd == CMD_INIT:
-                self.initializations.append(line.data)
-            elif line.cmd == CMD_FINI:
-                self.finalizations.append(line.data)
-            elif line.cmd == CMD_SINGLE:
-                ts += line.data[0]
-                self.schedule.append(SequenceStep(ts, line.data[1]))
-            elif line.cmd == CMD_PERIODIC:
-                for _ts in frange(line.data[1], run_time, line.data[0]):
-                    _ts = _ts + line.data[0]
-                    self.schedule.append(SequenceStep(_ts, line.data[2]))
-            elif line.cmd in (CMD_REPEAT_BEGIN, CMD_REPEAT_END):
-                raise RuntimeError('repeats not supported yet')
-            elif line.cmd == CMD_LOAD_RESOURCES:
-                self.resources.append(line.data)
-
-        # sort schedule by timestamp
-        self.schedule.sort(key=lambda x: x.timestamp)
+        (root, others, periods) = self._build_root(lines)
+        for line in others:
+            self._add_line(line)
+        self._root = root
+        self._periods = periods
+        self.run_time = root.duration
+        if self.hot_reload:
+            self._commands = self._step_commands(lines)
+
+        self._compile_methods(lines)
+        self._loaded(schedule)
+
+    def _scan_sequence_file(self, filename):
+        """Loads a sequence file in streaming mode.
+
+        The file is read once to collect the initialization, finalization,
+        resource and top-level periodic commands, to compile the methods and
+        to compute the run time. The single steps and repeat blocks are not
+        kept, they are read from the file again while the sequence is
+        running, see StreamedSteps.
+        """
+        parser = SequenceFileParser(filename, lazy=True)
+
+        def compiled_lines():
+            for line in parser.iter_lines():
+                # top-level single steps are executed only once, thus
+                # caching their code would only waste memory
+                self._compile_line(line, line.cmd != CMD_SINGLE or
+                                   parser.repeat_depth > 0)
+                yield line
+
+        root = RepeatBlock()
+        lines = enumerate(compiled_lines())
+        for (order, item) in self._group_lines(lines, self._periods):
+            if isinstance(item, RepeatBlock):
+                root.duration += item.count * item.duration
+            elif item.cmd == CMD_SINGLE:
+                root.duration += item.data[0]
+            elif item.cmd == CMD_PERIODIC:
+                root.periodics.append((order, item.data))
+            else:
+                self._add_line(item)
+        root.steps = StreamedSteps(self, filename)
+        self._root = root
+        self.run_time = root.duration
+        self._loaded(None)
+
+    def _loaded(self, schedule):
+        # the schedule is only built when it is accessed, e.g. a cached one
+        self._schedule = schedule
 
         # dump parsed information
         logger.debug('Resource files:')
@@ -225,62 +678,367 @@ class Sequencer(object):
         for method in self.initializations:
             logger.debug('  %s', method)
 
-        logger.debug('Computed schedule:')
-        for step in self.schedule:
-            logger.debug('  %6.2f %s', step.timestamp, step.method)
+        if self.streaming:
+            logger.debug('Streaming schedule, run time %.2f', self.run_time)
+        elif logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Computed schedule:')
+            for step in self.iter_schedule():
+                logger.debug('  %6.2f %s', step.timestamp, step.method)
+
+    def load_sequence_file(self, filename, cache=None, with_schedule=False):
+        """Loads a sequence file.
+
+        If a SequenceCache is given, the parsed lines and the schedule are
+        taken from the cache if the file and its resources are unchanged.
+        Otherwise the file is parsed and the result is stored in the cache.
+        The schedule is only built and stored if with_schedule is True,
+        otherwise it is built on first access of the schedule attribute.
+
+        In streaming mode the file is parsed incrementally and read again
+        while the sequence is running, the cache is not used.
+        """
+        self.filename = filename
+        if self.streaming:
+            self._scan_sequence_file(filename)
+            return
+
+        entry = None
+        if cache is not None:
+            entry = cache.load(filename, SequenceStep)
+
+        if entry is None:
+            # the signature is taken before parsing, so a change while
+            # parsing is not stored as the new content
+            signature = None if cache is None else cache.signature(filename)
+            lines = SequenceFileParser(filename).lines
+            schedule = None
+        else:
+            lines = [SequencerInputLine(*line) for line in entry[0]]
+            (schedule, signature) = entry[1:]
+
+        self._parse_input_lines(lines, schedule)
+
+        if cache is not None and (entry is None or
+                                  (schedule is None and with_schedule)):
+            cache.store(filename, lines,
+                        [self.resource_path(r) for r in self.resources],
+                        self.schedule if with_schedule else None, signature)
+
+    def resource_path(self, resource):
+        """Returns the path of a resource file.
+
+        Relative paths are resolved against the current directory and, if
+        the file does not exist there, against the directory of the sequence
+        file.
+        """
+        if os.path.isabs(resource) or os.path.exists(resource) or \
+                self.filename is None:
+            return resource
+        path = os.path.join(os.path.dirname(self.filename), resource)
+        if os.path.exists(path):
+            return path
+        return resource
 
-    def load_sequence_file(self, filename):
-        p = SequenceFileParser(filename)
-        self._parse_input_lines(p.lines)
+    def use_environment(self, environment):
+        """Replaces the environment by one which has the resources already
+        loaded, e.g. from an EnvironmentPool. The resources are not loaded
+        again on start() and the compiled methods are taken over."""
+        environment.code_cache.update(self.environment.code_cache)
+        self.environment = environment
+        self.prewarmed = True
 
     def _load_resources(self):
+        if self.prewarmed:
+            return
         for resource in self.resources:
             logger.debug('Loading resource %s', resource)
-            self.environment.load_script(resource)
+            self.environment.load_script(self.resource_path(resource),
+                                         self.script_cache)
 
     def _eval_initializations(self):
         for method in self.initializations:
             logger.debug('Evaluating %s', method)
             self.environment.evaluate(method)
 
-    def _eval_steps(self):
-        start_time = time.time()
-        for (ts, method) in self.schedule:
-            delay = start_time - time.time() + ts
-            if delay > 0:
-                time.sleep(delay)
+    def _step_started(self, index, ts, method):
+        if self.listeners:
+            self._notify('step_start', dict(index=index, timestamp=ts,
+                                            method=method))
 
-            logger.debug('Evaluating %s', method)
+    def _step_finished(self, index, ts, method, duration, error):
+        if self.listeners:
+            data = dict(index=index, timestamp=ts, method=method,
+                        duration=duration)
+            if error is None:
+                self._notify('step_end', data)
+            else:
+                data['error'] = format_error(error)
+                self._notify('step_error', data)
 
-            eval_begin = time.time()
-            try:
-                self.environment.evaluate(method)
-            except KeyboardInterrupt:
-                raise
-            except Exception:
-                logger.exception('Exception in step %s', method)
-            eval_end = time.time()
+    def _eval_step(self, method, index=None, ts=None):
+        logger.debug('Evaluating %s', method)
 
-            if (eval_end - eval_begin > 1):
-                logger.warning('Evaluating %s took longer than 1 second. '
-                               'Consider using the DataCacheThread class.',
-                               method)
+        self._step_started(index, ts, method)
+        eval_begin = time.monotonic()
+        error = None
+        try:
+            self.environment.evaluate(method)
+        except KeyboardInterrupt:
+            raise
+        except Exception as e:
+            logger.exception('Exception in step %s', method)
+            error = e
+        eval_end = time.monotonic()
+        self.metrics.record(method, eval_end - eval_begin, error)
+        self._step_finished(index, ts, method, eval_end - eval_begin, error)
+
+        if (eval_end - eval_begin > 1):
+            logger.warning('Evaluating %s took longer than 1 second. '
+                           'Consider using the DataCacheThread class.',
+                           method)
+
+    def _load_changes(self):
+        """Parses the sequence file if it was changed since the last check.
+
+        Returns the parsed lines, their top-level RepeatBlock, the init,
+        finalize and load commands and the periods, or None if the file is
+        unchanged or could not be parsed. The sequencer itself is not
+        changed, thus the file may be parsed in another thread while the
+        steps are running.
+        """
+        try:
+            st = os.stat(self.filename)
+        except OSError:
+            return None
+        signature = (st.st_mtime_ns, st.st_size)
+        if signature == self._file_signature:
+            return None
+        self._file_signature = signature
+
+        try:
+            lines = SequenceFileParser(self.filename).lines
+            (root, others, periods) = self._build_root(lines)
+            self._compile_methods(lines)
+        except (ParseError, OSError) as e:
+            logger.error('Not reloading %s: %s', self.filename, e)
+            return None
+        return (lines, root, others, periods)
+
+    def _apply_changes(self, changes):
+        """Replaces the single and periodic steps by those of a result of
+        _load_changes(), changes of the init, finalize and load commands are
+        not applied. Returns the set of the orders (line indices) of the
+        commands which were running before."""
+        (lines, root, others, periods) = changes
+        if [line.data for line in others if line.cmd == CMD_LOAD_RESOURCES] \
+                != self.resources:
+            logger.warning('Changed resources of %s are not loaded',
+                           self.filename)
+
+        commands = self._step_commands(lines)
+        logger.info('Reloading %s: %d commands added, %d removed',
+                    self.filename, len(commands - self._commands),
+                    len(self._commands - commands))
+        unchanged = set(order for (order, line) in enumerate(lines)
+                        if line.cmd in (CMD_SINGLE, CMD_PERIODIC) and
+                        (line.cmd, tuple(line.data)) in self._commands)
+        self._commands = commands
+        self._root = root
+        self._periods = periods
+        self.run_time = root.duration
+        self._schedule = None
+        self._notify('run_reload', dict(filename=self.filename,
+                                        run_time=self.run_time))
+        return unchanged
+
+    def _reload(self):
+        """Reloads the sequence file if it was changed since the last check.
+
+        Returns the set of the orders of the commands which were running
+        before, or None if the file is unchanged or could not be parsed, see
+        _apply_changes().
+        """
+        changes = self._load_changes()
+        if changes is None:
+            return None
+        return self._apply_changes(changes)
+
+    def _watch_file(self, stop, ready):
+        # parses the changed sequence file in the background, the result is
+        # applied by _watched_steps(), a new change is only looked at once
+        # the previous one is applied
+        while not stop.wait(self.reload_interval):
+            if ready.is_set():
+                continue
+            changes = self._load_changes()
+            if changes is not None:
+                self._changes = changes
+                ready.set()
+
+    def _resumed_steps(self, unchanged, executed, last_ts, now):
+        """Returns the steps of the reloaded sequence which are still ahead.
+
+        executed counts the single steps which already ran per method. The
+        first that many single steps of every method are skipped, the others
+        are still due. Those of added commands which are scheduled before now
+        are started at now.
+
+        Periodic steps up to last_ts were already executed, their generators
+        start right there instead of replaying the elapsed timeline. Steps
+        of unchanged periodic commands between last_ts and now are still
+        due, while the steps of added periodic commands start after now, so
+        the elapsed timeline is kept.
+        """
+        seen = Counter()
+        for (ts, order, method) in self._block_steps(self._root, 0.0,
+                                                     last_ts):
+            if order not in self._periods:
+                seen[method] += 1
+                if seen[method] <= executed[method]:
+                    continue
+                if ts < now and order not in unchanged:
+                    ts = now
+            elif ts <= last_ts or (ts < now and order not in unchanged):
+                continue
+            yield (ts, order, method)
+
+    def _watched_steps(self):
+        """Yields the steps like _iter_steps(), but checks the sequence file
+        for changes while waiting for the next step. The file is parsed in a
+        watcher thread, on a change the future steps are rescheduled, see
+        _apply_changes()."""
+        st = os.stat(self.filename)
+        self._file_signature = (st.st_mtime_ns, st.st_size)
+        stop = threading.Event()
+        ready = threading.Event()
+        watcher = threading.Thread(target=self._watch_file,
+                                   args=(stop, ready), daemon=True,
+                                   name='qseq-reload')
+        watcher.start()
+        try:
+            steps = self._iter_steps()
+            last_ts = None
+            # the number of executed single steps per method
+            executed = Counter()
+            step = next(steps, None)
+            while step is not None:
+                # steps with the same timestamp are never split by a reload
+                while step[0] != last_ts and \
+                        ready.wait(max(0.0, self.timer.remaining(step[0]))):
+                    unchanged = self._apply_changes(self._changes)
+                    ready.clear()
+                    steps = self._resumed_steps(
+                        unchanged, executed,
+                        -1.0 if last_ts is None else last_ts,
+                        self.timer.now())
+                    step = next(steps, None)
+                    if step is None:
+                        return
+                last_ts = step[0]
+                if step[1] not in self._periods:
+                    executed[step[2]] += 1
+                yield step
+                step = next(steps, None)
+        finally:
+            stop.set()
+
+    def set_overrun_policy(self, policy, method=None):
+        """Sets the overrun policy of the periodic steps of a method
+        expression or, if method is None, of all periodic steps.
+
+        OVERRUN_CATCH_UP runs every missed step as soon as possible, this is
+        the default. OVERRUN_COALESCE runs only the latest of the missed
+        steps, that is a step is dropped if the next one is due as well.
+        OVERRUN_SKIP drops every step which is late by more than half of its
+        period and continues with the next slot in the future. Dropped steps
+        are counted in metrics.
+        """
+        if policy not in OVERRUN_POLICIES:
+            raise ValueError('Unknown overrun policy %r' % (policy,))
+        if method is None:
+            self.overrun_policy = policy
+        else:
+            self.overrun_policies[method] = policy
+
+    def _overrun(self, ts, order, method):
+        """Applies the overrun policy to a periodic step, returns True if the
+        step is dropped."""
+        policy = self.overrun_policies.get(method, self.overrun_policy)
+        if policy == OVERRUN_CATCH_UP:
+            return False
+        lateness = self.timer.now() - ts
+        period = self._periods[order]
+        if policy == OVERRUN_COALESCE:
+            if lateness < period:
+                return False
+        elif lateness <= period / 2:
+            return False
+        self.metrics.record_overrun(method, policy)
+        return True
+
+    def _eval_steps(self):
+        self.dispatcher.start()
+        if self.hot_reload:
+            steps = self._watched_steps()
+        else:
+            steps = self._iter_steps()
+        try:
+            self.timer.start()
+            for (index, (ts, order, method)) in enumerate(steps):
+                if order in self._periods and self._overrun(ts, order,
+                                                            method):
+                    continue
+                lateness = self.timer.wait_until(ts)
+                self.metrics.record_lateness(method, lateness)
+                self.dispatcher.dispatch(method, self._eval_step, index, ts,
+                                         periodic=order in self._periods)
+        finally:
+            # stops the watcher thread of a hot reload
+            steps.close()
+            self.dispatcher.shutdown()
+        logger.info(self.timer.format_summary())
 
     def _eval_finalizations(self):
         for method in self.finalizations:
             logger.debug('Evaluating %s', method)
             self.environment.evaluate(method)
 
-    def start(self):
+    def _inject_globals(self):
         self.environment.inject_global('qseq_start_timestamp',
                                        QSEQ_START_TIMESTAMP)
         self.environment.inject_global('qseq_timestamp', QSEQ_TIMESTAMP)
-        self.environment.inject_global('qseq_log', QSEQ_LOG)
+        self.environment.inject_global('qseq_time', self.timer.time)
+        self.environment.inject_global('qseq_sleep', self.timer.sleep)
+        self.environment.inject_global('qseq_log', self.log)
+
+    def _run_started(self):
+        self._notify('run_start', dict(filename=self.filename,
+                                       run_time=self.run_time))
 
-        self._load_resources()
-        self._eval_initializations()
-        self._eval_steps()
-        self._eval_finalizations()
+    def _run_finished(self, error=None):
+        if error is not None:
+            error = format_error(error)
+        self._notify('run_end', dict(filename=self.filename, error=error))
+
+    def start(self):
+        if self.timer.virtual:
+            set_clock(self.timer)
+        self._run_started()
+        try:
+            self._inject_globals()
+            self._load_resources()
+            self._eval_initializations()
+            self._eval_steps()
+            self._eval_finalizations()
+        except BaseException as e:
+            self.log.flush()
+            self._run_finished(e)
+            raise
+        finally:
+            if self.timer.virtual:
+                set_clock(None)
+        self.log.flush()
+        self._run_finished()
 
 
 QSEQ_LOG = CsvLog()
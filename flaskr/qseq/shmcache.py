@@ -0,0 +1,121 @@
+import time
+import pickle
+import struct
+import logging
+from multiprocessing import shared_memory
+
+from .datacache import Snapshot
+
+logger = logging.getLogger(__name__)
+
+# magic, version, sequence counter, timestamp, duration, payload length
+HEADER = struct.Struct('<4sIQddQ')
+MAGIC = b'QSHM'
+VERSION = 1
+# the sequence counter and the fields which follow it in the header
+SEQ_OFFSET = 8
+SEQ = struct.Struct('<Q')
+FIELDS_OFFSET = 16
+FIELDS = struct.Struct('<ddQ')
+
+
+class SharedMemoryPublisher(object):
+    """Publishes the datasets of a DataCache to other local processes.
+
+    The latest dataset is pickled into a shared memory block together with
+    its timestamp and duration, see SharedMemoryReader for the reading side.
+    The block is protected by a seqlock: the sequence counter is odd while
+    the dataset is written, so readers never block the writer and retry if
+    the counter changed while they were reading.
+
+    Assign the publisher to the publisher attribute of a DataCache to
+    publish every acquired dataset. Datasets larger than size bytes are not
+    published and logged.
+    """
+
+    def __init__(self, name=None, size=1 << 20):
+        self.shm = shared_memory.SharedMemory(name=name, create=True,
+                                              size=HEADER.size + size)
+        self.name = self.shm.name
+        self.capacity = size
+        self.seq = 0
+        HEADER.pack_into(self.shm.buf, 0, MAGIC, VERSION, 0, 0.0, 0.0, 0)
+
+    def publish(self, timestamp, duration, data):
+        payload = pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+        if len(payload) > self.capacity:
+            logger.error('Dataset of %d bytes does not fit into shared '
+                         'memory %s', len(payload), self.name)
+            return
+        buf = self.shm.buf
+        SEQ.pack_into(buf, SEQ_OFFSET, self.seq + 1)
+        FIELDS.pack_into(buf, FIELDS_OFFSET, timestamp, duration,
+                         len(payload))
+        buf[HEADER.size:HEADER.size + len(payload)] = payload
+        # the counter is written last, it makes the dataset visible
+        self.seq += 2
+        SEQ.pack_into(buf, SEQ_OFFSET, self.seq)
+
+    def close(self, unlink=True):
+        """Closes the shared memory block, by default it is also removed."""
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # before Python 3.13 every attached block is registered with the
+        # resource tracker, which would remove it when this process exits.
+        # Readers sharing the tracker of the publisher (same process or
+        # forked) make the tracker warn about it when the block is unlinked.
+        from multiprocessing import resource_tracker
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+class SharedMemoryReader(object):
+    """Reads the datasets published by a SharedMemoryPublisher.
+
+    Reading never blocks the publisher. If the dataset is changed while it
+    is copied, the read is retried until timeout seconds passed.
+    """
+
+    def __init__(self, name, timeout=1.0):
+        self.shm = _attach(name)
+        self.name = name
+        self.timeout = timeout
+        (magic, version) = HEADER.unpack_from(self.shm.buf, 0)[:2]
+        if magic != MAGIC or version != VERSION:
+            self.shm.close()
+            raise ValueError('%s is not a qseq shared memory block' % name)
+
+    def seqno(self):
+        """Returns the number of the latest published dataset, 0 if nothing
+        was published yet."""
+        return SEQ.unpack_from(self.shm.buf, SEQ_OFFSET)[0] // 2
+
+    def read(self, newer_than=0):
+        """Returns the latest dataset as a Snapshot, or None if there is no
+        dataset with a seqno greater than newer_than."""
+        buf = self.shm.buf
+        deadline = time.monotonic() + self.timeout
+        while True:
+            (magic, version, seq, timestamp, duration, length) = \
+                HEADER.unpack_from(buf, 0)
+            if seq // 2 <= newer_than and not seq & 1:
+                return None
+            if not seq & 1:
+                payload = bytes(buf[HEADER.size:HEADER.size + length])
+                if SEQ.unpack_from(buf, SEQ_OFFSET)[0] == seq:
+                    return Snapshot(seq // 2, timestamp, duration,
+                                    pickle.loads(payload))
+            if time.monotonic() > deadline:
+                raise TimeoutError('No consistent dataset in %s' % self.name)
+            time.sleep(0)
+
+    def close(self):
+        self.shm.close()
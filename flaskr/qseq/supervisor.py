@@ -0,0 +1,167 @@
+#!/usr/bin/env python3.11
+
+import os
+import sys
+import json
+import time
+import logging
+from optparse import OptionParser
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from qseq import __version__
+from qseq.sequencer import Sequencer, format_error
+from qseq.csvlog import BufferedCsvLog
+
+logger = logging.getLogger(__name__)
+
+
+def find_sequences(paths):
+    """Returns the sequence files given on the command line, directories are
+    searched for *.seq files."""
+    files = list()
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith('.seq'):
+                    files.append(os.path.join(path, name))
+        else:
+            files.append(path)
+    return files
+
+
+def log_filenames(log_dir, files):
+    """Returns the log file of every sequence file in files.
+
+    The log files are named after the sequence files. If several sequence
+    files have the same name, e.g. a/x.seq and b/x.seq, a number is appended
+    to the later ones (x.csv, x-2.csv), so no log is overwritten.
+    """
+    names = list()
+    used = set()
+    for filename in files:
+        base = os.path.splitext(os.path.basename(filename))[0]
+        name = base
+        i = 1
+        while name in used:
+            i += 1
+            name = '%s-%d' % (base, i)
+        used.add(name)
+        names.append(os.path.join(log_dir, name + '.csv'))
+    return names
+
+
+def run_sequence(filename, log_filename):
+    """Runs one sequence file, this is executed in a worker process."""
+    result = dict(file=filename, pid=os.getpid(), log=log_filename,
+                  error=None)
+    log = None
+    started = time.time()
+    try:
+        log = BufferedCsvLog(log_filename)
+        # the sequence file is streamed, thus the memory of a worker does
+        # not grow with the length of the sequence
+        s = Sequencer(streaming=True, log=log)
+        s.load_sequence_file(filename)
+        s.start()
+        result['status'] = 0
+    except Exception as e:
+        logger.exception('Sequence %s failed', filename)
+        result['status'] = 1
+        result['error'] = format_error(e)
+    finally:
+        if log is not None:
+            log.close()
+    result['started'] = started
+    result['duration'] = time.time() - started
+    return result
+
+
+def format_summary(results, wall_time):
+    lines = ['%-40s %6s %10s  %s' % ('SEQUENCE', 'STATUS', 'DURATION',
+                                     'ERROR')]
+    for r in results:
+        lines.append('%-40s %6s %9.2fs  %s' % (r['file'],
+                                               'ok' if r['status'] == 0
+                                               else 'FAIL',
+                                               r['duration'],
+                                               r['error'] or ''))
+    failed = sum(1 for r in results if r['status'] != 0)
+    longest = max([r['duration'] for r in results] or [0.0])
+    lines.append('%d sequences, %d failed, wall time %.2fs, longest '
+                 'sequence %.2fs' % (len(results), failed, wall_time,
+                                     longest))
+    return '\n'.join(lines)
+
+
+def main():
+    usage = "usage: %prog [options] sequencefile|directory ..."
+
+    parser = OptionParser(usage=usage)
+    parser.add_option('-v', '--verbose', action='store_true', dest='verbose',
+                      help='be more verbose')
+    parser.add_option('-V', '--version', action='store_true', dest='version',
+                      help='show version')
+    parser.add_option('-j', '--jobs', type='int', dest='jobs',
+                      default=os.cpu_count() or 1,
+                      help='number of sequences running at the same time '
+                      '[default: number of cores, %default]')
+    parser.add_option('--log-dir', dest='log_dir', default='.',
+                      metavar='DIR',
+                      help='directory for the log files, one per sequence '
+                      '[default: %default]')
+    parser.add_option('--json', dest='json', metavar='FILE',
+                      help='write the summary as JSON to FILE')
+
+    (options, args) = parser.parse_args()
+
+    if options.version:
+        print('%s v%s' % (os.path.basename(sys.argv[0]), __version__))
+        sys.exit()
+
+    files = find_sequences(args)
+    if len(files) < 1:
+        parser.print_help()
+        sys.exit(1)
+
+    logging.basicConfig()
+    if options.verbose:
+        logging.getLogger().setLevel(logging.DEBUG)
+
+    os.makedirs(options.log_dir, exist_ok=True)
+
+    # every sequence gets a fresh process, thus resource scripts and the
+    # modules they import never leak from one sequence into the next
+    results = list()
+    started = time.time()
+    with ProcessPoolExecutor(max_workers=options.jobs,
+                             max_tasks_per_child=1) as executor:
+        futures = dict((executor.submit(run_sequence, f, log), i)
+                       for (i, (f, log)) in enumerate(zip(
+                           files, log_filenames(options.log_dir, files))))
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                # the worker process died
+                result = dict(file=files[futures[future]], status=1,
+                              duration=0.0, error=format_error(e))
+            logger.info('%s finished with status %d after %.2fs',
+                        result['file'], result['status'], result['duration'])
+            results.append((futures[future], result))
+    wall_time = time.time() - started
+
+    results = [result for (i, result) in sorted(results,
+                                                key=lambda r: r[0])]
+    print(format_summary(results, wall_time))
+
+    if options.json:
+        with open(options.json, 'w') as f:
+            json.dump(dict(wall_time=wall_time, results=results), f,
+                      indent=2)
+
+    if any(r['status'] != 0 for r in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
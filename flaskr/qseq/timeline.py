@@ -0,0 +1,87 @@
+import array
+
+
+class TimelineIndex(object):
+    """Step counts per method over time at several resolutions.
+
+    The time range from 0 to the last step is divided into resolution equally
+    sized buckets (rounded up to a power of two) and the steps of every
+    method are counted per bucket. Every coarser level has half as many
+    buckets, down to a single bucket. A query for a time window picks the
+    coarsest level which still resolves the window into the requested number
+    of buckets, so the cost of a query depends on the number of returned
+    buckets and methods only, not on the number of steps.
+    """
+
+    def __init__(self, steps, run_time=0.0, resolution=4096):
+        size = 1
+        while size < resolution:
+            size *= 2
+        self.resolution = size
+
+        # the steps are sorted by time, the last one may be after the run
+        # time (periodic steps of the top level). If steps is an iterator,
+        # e.g. iter_schedule() in streaming mode, it is not materialized and
+        # such steps are counted in the last bucket.
+        end = run_time
+        if hasattr(steps, '__len__') and len(steps):
+            end = max(end, steps[len(steps) - 1].timestamp)
+        if end <= 0:
+            end = 1.0
+        self.end = end
+        self.total = 0
+
+        width = end / size
+        counts = dict()
+        for step in steps:
+            self.total += 1
+            method_counts = counts.get(step.method)
+            if method_counts is None:
+                method_counts = counts[step.method] = \
+                    array.array('I', bytes(4 * size))
+            method_counts[min(int(step.timestamp / width), size - 1)] += 1
+
+        # levels[0] is the finest one
+        self.levels = [counts]
+        while size > 1:
+            size //= 2
+            counts = dict((method, array.array('I', (
+                c[2 * i] + c[2 * i + 1] for i in range(size))))
+                for (method, c) in counts.items())
+            self.levels.append(counts)
+        self.methods = sorted(self.levels[0])
+
+    def bucket_width(self, level):
+        return self.end * 2 ** level / self.resolution
+
+    def _level(self, span, buckets):
+        """Returns the coarsest level whose buckets are at most
+        span / buckets wide."""
+        level = 0
+        while level + 1 < len(self.levels) and \
+                self.bucket_width(level + 1) <= span / buckets:
+            level += 1
+        return level
+
+    def query(self, start=None, end=None, buckets=200):
+        """Returns the step counts of every method between start and end.
+
+        The result is a dict with start, end and width of the returned
+        buckets, the level and counts, a dict mapping the methods to lists
+        of counts. The window is aligned to the buckets of the level, thus it
+        may be slightly larger than requested.
+        """
+        start = 0.0 if start is None else min(max(0.0, start), self.end)
+        end = self.end if end is None else min(self.end, end)
+        end = max(start, end)
+        level = self._level(max(end - start, self.bucket_width(0)),
+                            max(1, buckets))
+        width = self.bucket_width(level)
+        size = self.resolution >> level
+        first = min(int(start / width), size - 1)
+        last = max(first + 1, min(size, -int(-end // width)))
+        counts = self.levels[level]
+        return dict(start=first * width, end=last * width, width=width,
+                    level=level,
+                    counts=dict((method, counts[method][first:last].tolist())
+                                for method in self.methods))
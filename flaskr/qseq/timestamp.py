@@ -1,4 +1,19 @@
 import time
 
 QSEQ_START_TIMESTAMP = time.time()
-def QSEQ_TIMESTAMP(): return time.time() - QSEQ_START_TIMESTAMP
+
+# clock which replaces the wall clock, see set_clock()
+_clock = None
+
+
+def set_clock(clock):
+    """Replaces the wall clock of QSEQ_TIMESTAMP() by clock.timestamp(), e.g.
+    a VirtualTimer in simulation mode. None restores the wall clock."""
+    global _clock
+    _clock = clock
+
+
+def QSEQ_TIMESTAMP():
+    if _clock is not None:
+        return _clock.timestamp()
+    return time.time() - QSEQ_START_TIMESTAMP
@@ -0,0 +1,237 @@
+import math
+import time
+import logging
+import threading
+
+from .timestamp import QSEQ_START_TIMESTAMP
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyHistogram(object):
+    """A histogram with logarithmic buckets for latencies in seconds.
+
+    Every power of two is divided into a fixed number of sub buckets, so the
+    relative error of a percentile is bounded (about 9% with the default of
+    eight sub buckets) and the memory usage does not depend on the number of
+    recorded values. Count, sum, minimum and maximum are tracked exactly.
+    """
+
+    # resolution of the smallest bucket
+    UNIT = 1e-6
+
+    def __init__(self, sub_buckets=8):
+        self.sub_buckets = sub_buckets
+        self.buckets = dict()
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def _bucket(self, value):
+        units = value / self.UNIT
+        if units < 1:
+            return 0
+        return int(math.log2(units) * self.sub_buckets) + 1
+
+    def _bucket_value(self, bucket):
+        if bucket == 0:
+            return 0.0
+        return self.UNIT * 2 ** ((bucket - 1) / self.sub_buckets)
+
+    def record(self, value):
+        bucket = self._bucket(value)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def mean(self):
+        if self.count == 0:
+            return None
+        return self.total / self.count
+
+    def percentile(self, p):
+        """Returns the approximate p-th percentile (0 <= p <= 100)."""
+        if self.count == 0:
+            return None
+        rank = max(1, int(math.ceil(self.count * p / 100.0)))
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(max(self._bucket_value(bucket), self.min), self.max)
+        return self.max
+
+    def summary(self, percentiles=(50, 90, 99, 99.9)):
+        """Returns a dict with count, mean, min, max and the percentiles."""
+        ret = dict(count=self.count, mean=self.mean(), min=self.min,
+                   max=self.max)
+        for p in percentiles:
+            ret['p%s' % ('%g' % p)] = self.percentile(p)
+        return ret
+
+
+class MonotonicTimer(object):
+    """Waits for absolute deadlines on the monotonic clock.
+
+    The deadline of every step is computed from the start time of the run and
+    the timestamp of the step. Thus, errors do not accumulate and changes of
+    the wall clock (e.g. NTP steps) do not affect the schedule.
+
+    For each deadline the lateness, that is how late wait_until() actually
+    returned, is recorded in the jitter histogram.
+
+    The timer is also the clock of the sequence, time(), sleep() and
+    timestamp() are injected into the resource scripts.
+    """
+
+    # True if the timer does not follow the wall clock
+    virtual = False
+
+    def __init__(self):
+        self.start_ns = None
+        self.jitter = LatencyHistogram()
+
+    def start(self):
+        self.start_ns = time.monotonic_ns()
+        self.jitter = LatencyHistogram()
+
+    def now(self):
+        """Returns the seconds elapsed since start()."""
+        return (time.monotonic_ns() - self.start_ns) / 1e9
+
+    def time(self):
+        """Returns the wall clock time, like time.time()."""
+        return time.time()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def timestamp(self):
+        """Returns the seconds since QSEQ_START_TIMESTAMP."""
+        return time.time() - QSEQ_START_TIMESTAMP
+
+    def _deadline_ns(self, ts):
+        return self.start_ns + int(round(ts * 1e9))
+
+    def _wait(self, deadline_ns):
+        remaining = deadline_ns - time.monotonic_ns()
+        if remaining > 0:
+            time.sleep(remaining / 1e9)
+
+    def remaining(self, ts):
+        """Returns the seconds until ts, negative if ts is already over.
+
+        This is meant for callers which wait on their own, e.g. on an event
+        loop. They have to call record_start() once the step is started.
+        """
+        return (self._deadline_ns(ts) - time.monotonic_ns()) / 1e9
+
+    def record_start(self, ts):
+        """Records the lateness of a step scheduled at ts and returns it."""
+        lateness = max(0, time.monotonic_ns() - self._deadline_ns(ts)) / 1e9
+        self.jitter.record(lateness)
+        return lateness
+
+    def wait_until(self, ts):
+        """Blocks until ts seconds after start() and returns the lateness in
+        seconds."""
+        self._wait(self._deadline_ns(ts))
+        return self.record_start(ts)
+
+    def format_summary(self):
+        """Returns a one line summary of the step start lateness."""
+        s = self.jitter.summary()
+        if s['count'] == 0:
+            return 'No steps executed'
+        return ('Step start lateness over %d steps: mean %.3f ms, '
+                'p50 %.3f ms, p90 %.3f ms, p99 %.3f ms, p99.9 %.3f ms, '
+                'max %.3f ms' % (s['count'], s['mean'] * 1e3,
+                                 s['p50'] * 1e3, s['p90'] * 1e3,
+                                 s['p99'] * 1e3, s['p99.9'] * 1e3,
+                                 s['max'] * 1e3))
+
+
+class HybridTimer(MonotonicTimer):
+    """A timer which sleeps until shortly before the deadline and busy waits
+    for the rest of the time.
+
+    This trades CPU time for sub-millisecond accuracy. The spin threshold is
+    the time in seconds before the deadline at which sleeping is stopped.
+    """
+
+    def __init__(self, spin_threshold=0.002):
+        MonotonicTimer.__init__(self)
+        self.spin_threshold_ns = int(spin_threshold * 1e9)
+
+    def _wait(self, deadline_ns):
+        remaining = deadline_ns - time.monotonic_ns() - self.spin_threshold_ns
+        if remaining > 0:
+            time.sleep(remaining / 1e9)
+        while time.monotonic_ns() < deadline_ns:
+            pass
+
+
+class VirtualTimer(MonotonicTimer):
+    """A timer on a virtual clock for simulation runs.
+
+    Waiting and sleeping do not block, they advance the virtual clock. Thus,
+    the steps are executed as fast as possible, while they still see
+    consistent timestamps through qseq_time(), qseq_sleep() and
+    qseq_timestamp(). The virtual clock starts at the wall clock time the
+    timer is created or at origin.
+
+    A step which is evaluated for a while does not advance the clock, only
+    sleep() does. Thus, the lateness is always zero unless steps sleep longer
+    than the time until the next step.
+    """
+
+    virtual = True
+
+    def __init__(self, origin=None):
+        MonotonicTimer.__init__(self)
+        self.lock = threading.Lock()
+        self.origin = time.time() if origin is None else origin
+        # virtual seconds since origin
+        self.clock = 0.0
+        self.start_clock = 0.0
+
+    def start(self):
+        self.start_clock = self.clock
+        self.jitter = LatencyHistogram()
+
+    def now(self):
+        return self.clock - self.start_clock
+
+    def time(self):
+        return self.origin + self.clock
+
+    def sleep(self, seconds):
+        with self.lock:
+            self.clock += max(0.0, seconds)
+
+    def timestamp(self):
+        return self.origin + self.clock - QSEQ_START_TIMESTAMP
+
+    def _advance(self, ts):
+        with self.lock:
+            self.clock = max(self.clock, self.start_clock + ts)
+
+    def remaining(self, ts):
+        """Advances the clock to ts and returns 0, so callers which wait on
+        their own do not wait at all."""
+        self._advance(ts)
+        return 0.0
+
+    def record_start(self, ts):
+        lateness = max(0.0, self.now() - ts)
+        self.jitter.record(lateness)
+        return lateness
+
+    def wait_until(self, ts):
+        self._advance(ts)
+        return self.record_start(ts)
@@ -0,0 +1,279 @@
+import time
+import uuid
+import logging
+import threading
+
+from .qseq.sequencer import Sequencer, format_error  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+STEP_STATUS = {
+    'step_start': 'running',
+    'step_end': 'done',
+    'step_error': 'error',
+}
+
+
+class EventBatcher(object):
+    """Collects step events and emits them in batches.
+
+    Step events are coalesced per method, that is only the latest event of
+    every method is kept until the next flush, together with counts, a dict
+    mapping the event names to the number of events since the last flush,
+    and coalesced, which is True if events of several steps were merged.
+    Thus, a high-rate periodic step costs one event per flush, no matter how
+    often it is called. Run events are never coalesced. Every interval
+    seconds the pending events are handed over to emit() as a list.
+    """
+
+    def __init__(self, emit, interval=0.1):
+        self.emit = emit
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.steps = dict()
+        self.counts = dict()
+        self.runs = list()
+        self.stop_request = False
+
+    def add(self, event, data):
+        data = dict(data, event=event)
+        with self.lock:
+            if event in STEP_STATUS:
+                method = data.get('method')
+                latest = self.steps.get(method)
+                if latest is None:
+                    counts = self.counts[method] = dict()
+                    data['coalesced'] = False
+                else:
+                    counts = self.counts[method]
+                    data['coalesced'] = latest['coalesced'] or \
+                        latest['index'] != data['index']
+                counts[event] = counts.get(event, 0) + 1
+                self.steps[method] = data
+            else:
+                self.runs.append(data)
+
+    def flush(self):
+        with self.lock:
+            events = [dict(data, counts=self.counts[method])
+                      for (method, data) in self.steps.items()]
+            events.extend(self.runs)
+            self.steps = dict()
+            self.counts = dict()
+            self.runs = list()
+        if events:
+            self.emit(events)
+
+    def run(self, sleep=time.sleep):
+        while not self.stop_request:
+            sleep(self.interval)
+            self.flush()
+        self.flush()
+
+    def stop(self):
+        self.stop_request = True
+
+
+class SequenceRun(object):
+    """A run of a sequence file in a background worker.
+
+    The status of the steps is tracked in statuses, a dict mapping the
+    index of the step in the schedule to 'running', 'done' or 'error'.
+    Events are pushed to the socket.io room of the file in batches.
+
+    If a RunHistory is given, the run and its finished steps are stored in
+    it and only the running steps are kept in statuses, thus the memory does
+    not grow with the number of executed steps. If an EnvironmentPool is
+    given, the run takes a prewarmed environment with the resource scripts
+    already loaded.
+    """
+
+    def __init__(self, socketio, file, filename, history=None, pool=None,
+                 script_cache=None):
+        self.socketio = socketio
+        self.history = history
+        self.pool = pool
+        self.script_cache = script_cache
+        self.id = uuid.uuid4().hex
+        self.file = file
+        self.filename = filename
+        self.state = 'pending'
+        self.error = None
+        self.started = None
+        self.finished = None
+        self.statuses = dict()
+        # statuses are written by the run and read by the requests
+        self.lock = threading.Lock()
+        self.metrics = None
+        self.batcher = EventBatcher(self._emit)
+
+    def _emit(self, events):
+        self.socketio.emit('run_events', dict(run_id=self.id, file=self.file,
+                                              events=events), to=self.file)
+
+    def _on_event(self, event, data):
+        status = STEP_STATUS.get(event)
+        if status is not None:
+            if self.history is None or event == 'step_start':
+                with self.lock:
+                    self.statuses[data['index']] = status
+            else:
+                # queued before it is dropped, so step_statuses() finds
+                # the step in one of both
+                self.history.add_step(self.id, status, data)
+                with self.lock:
+                    self.statuses.pop(data['index'], None)
+        self.batcher.add(event, data)
+
+    def status(self, index):
+        return self.step_statuses(index, index + 1).get(index, 'waiting')
+
+    @property
+    def active(self):
+        return self.state in ('pending', 'running')
+
+    def _live_statuses(self, first, last):
+        with self.lock:
+            statuses = self.statuses
+            if last - first > len(statuses):
+                return dict((i, status) for (i, status) in statuses.items()
+                            if first <= i < last)
+            return dict((i, statuses[i]) for i in range(first, last)
+                        if i in statuses)
+
+    def step_statuses(self, first, last):
+        """Returns a dict mapping the indices first <= index < last of the
+        started steps to their status.
+
+        With a history, the finished steps are read from it, after the steps
+        queued so far are written.
+        """
+        if self.history is None:
+            return self._live_statuses(first, last)
+        # read before the history, a step finishing meanwhile is found in
+        # the history, which takes precedence
+        running = self._live_statuses(first, last) if self.active else {}
+        self.history.flush()
+        statuses = self.history.step_statuses(self.id, first, last)
+        for (i, status) in running.items():
+            statuses.setdefault(i, status)
+        return statuses
+
+    def _save(self):
+        if self.history is not None:
+            try:
+                self.history.save_run(self.info())
+            except Exception:
+                logger.exception('Failed to save run %s', self.id)
+
+    def info(self):
+        return dict(run_id=self.id, file=self.file, state=self.state,
+                    error=self.error, started=self.started,
+                    finished=self.finished)
+
+    def _run(self):
+        self.state = 'running'
+        self.started = time.time()
+        self._save()
+        state = 'failed'
+        try:
+            # the steps are generated while running, in the same order and
+            # with the same indices as the schedule shown in the UI
+            sequencer = Sequencer(streaming=True,
+                                  script_cache=self.script_cache)
+            self.metrics = sequencer.metrics
+            sequencer.load_sequence_file(self.filename)
+            if self.pool is not None:
+                sequencer.use_environment(self.pool.acquire(
+                    [sequencer.resource_path(r)
+                     for r in sequencer.resources]))
+            sequencer.add_listener(self._on_event)
+            sequencer.start()
+            state = 'finished'
+        except Exception as e:
+            logger.exception('Run %s of %s failed', self.id, self.file)
+            self.error = format_error(e)
+        finally:
+            self.finished = time.time()
+            # the final state is saved with all steps written
+            if self.history is not None:
+                self.history.flush()
+            self.state = state
+            self._save()
+            self.batcher.add('run_state', self.info())
+            self.batcher.stop()
+
+    def start(self):
+        self.socketio.start_background_task(self.batcher.run,
+                                            self.socketio.sleep)
+        self.socketio.start_background_task(self._run)
+
+
+class RunManager(object):
+    """Keeps track of the runs in this process, at most one active run per
+    sequence file. Runs of earlier processes are looked up in the history,
+    if there is one."""
+
+    def __init__(self, socketio, history=None, pool=None, script_cache=None):
+        self.socketio = socketio
+        self.history = history
+        self.pool = pool
+        self.script_cache = script_cache
+        self.lock = threading.Lock()
+        self.runs = dict()
+        self.latest = dict()
+
+    def start(self, file, filename):
+        """Starts a run and returns it, or returns None if the file is
+        already running."""
+        with self.lock:
+            run = self.latest.get(file)
+            if run is not None and run.active:
+                return None
+            run = SequenceRun(self.socketio, file, filename, self.history,
+                              self.pool, self.script_cache)
+            self.runs[run.id] = run
+            self.latest[file] = run
+        run.start()
+        return run
+
+    def get(self, run_id):
+        return self.runs.get(run_id)
+
+    def latest_run(self, file):
+        return self.latest.get(file)
+
+    def latest_runs(self):
+        with self.lock:
+            return list(self.latest.values())
+
+    def get_info(self, run_id):
+        """Returns the info dict of a run or None."""
+        run = self.runs.get(run_id)
+        if run is not None:
+            return run.info()
+        if self.history is not None:
+            return self.history.get_run(run_id)
+        return None
+
+    def latest_info(self, file):
+        """Returns the info dict of the latest run of a file or None."""
+        run = self.latest.get(file)
+        if run is not None:
+            return run.info()
+        if self.history is not None:
+            return self.history.latest_run(file)
+        return None
+
+    def step_statuses(self, file, first, last):
+        """Returns a dict mapping the indices first <= index < last of the
+        started steps of the latest run of a file to their status."""
+        run = self.latest.get(file)
+        if run is not None:
+            return run.step_statuses(first, last)
+        if self.history is not None:
+            info = self.history.latest_run(file)
+            if info is not None:
+                return self.history.step_statuses(info['run_id'], first,
+                                                  last)
+        return dict()
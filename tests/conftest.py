@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the qseq package is imported as a top-level package, like the CLI does
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'flaskr'))
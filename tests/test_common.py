@@ -0,0 +1,80 @@
+import math
+
+import pytest
+
+from qseq import common
+from qseq.common import grid_index, grid_blocks, frange
+from qseq.sequencer import Sequencer
+
+PERIODS = 10 ** 7
+
+
+def test_no_drift_over_ten_million_periods():
+    period = 0.1
+    values = [v for block in grid_blocks(0.0, period, 0, PERIODS + 1)
+              for v in block]
+    assert len(values) == PERIODS + 1
+    # every value is a single rounding of k*period, nothing accumulates
+    assert all(v == k * period for (k, v) in enumerate(values))
+    assert values[-1] == 1e6
+
+
+def test_no_drift_of_periodic_steps():
+    s = Sequencer()
+    steps = s._periodic_steps(0, 0.1, 0.0, 'f()', 0.0, PERIODS * 0.1, False)
+    count = 0
+    for (k, (ts, order, method)) in enumerate(steps, 1):
+        if ts != k * 0.1:
+            pytest.fail('step %d at %r instead of %r' % (k, ts, k * 0.1))
+        count += 1
+    assert count == PERIODS
+
+
+@pytest.mark.skipif(common.numpy is None, reason='numpy is not installed')
+@pytest.mark.parametrize('start, step', [(0.0, 0.1), (0.3, 1e-3),
+                                         (-5.0, 0.7), (1e6, -0.05)])
+def test_grid_blocks_numpy_and_python_agree(monkeypatch, start, step):
+    with_numpy = list(grid_blocks(start, step, 3, 20000, block_size=4096))
+    monkeypatch.setattr(common, 'numpy', None)
+    without_numpy = list(grid_blocks(start, step, 3, 20000, block_size=4096))
+    assert with_numpy == without_numpy
+    assert [len(b) for b in with_numpy] == [4096] * 4 + [20000 - 3 - 4 * 4096]
+
+
+def test_grid_index_counts_values_before_stop():
+    assert grid_index(0.0, 1.0, 0.1) == 10
+    assert grid_index(0.0, 1.0, 0.1, inclusive=True) == 11
+    assert grid_index(0.0, 0.95, 0.1) == 10
+    assert grid_index(0.0, 0.95, 0.1, inclusive=True) == 10
+    assert grid_index(1.0, 1.0, 0.1) == 0
+    assert grid_index(1.0, 1.0, 0.1, inclusive=True) == 1
+    assert grid_index(2.0, 1.0, 0.1) == 0
+
+
+def test_grid_index_negative_step():
+    assert grid_index(1.0, 0.0, -0.1) == 10
+    assert grid_index(1.0, 0.0, -0.1, inclusive=True) == 11
+    assert grid_index(0.0, 1.0, -0.1) == 0
+    assert list(frange(1.0, 0.0, -0.25)) == [1.0, 0.75, 0.5, 0.25]
+
+
+def test_grid_index_infinite_stop():
+    with pytest.raises(ValueError):
+        grid_index(0.0, math.inf, 1.0)
+    with pytest.raises(ValueError):
+        grid_index(0.0, -math.inf, -1.0)
+    # nothing lies before -inf, so the range is empty
+    assert grid_index(0.0, -math.inf, 1.0) == 0
+
+
+def test_grid_index_zero_step():
+    with pytest.raises(ValueError):
+        grid_index(0.0, 1.0, 0.0)
+
+
+def test_grid_index_matches_frange_length():
+    for (start, stop, step) in [(0.0, 1.0, 0.1), (0.1, 0.7, 0.1),
+                                (0.0, 1e3, 1e-3), (0.5, -0.5, -0.1)]:
+        values = list(frange(start, stop, step))
+        assert len(values) == grid_index(start, stop, step)
+        assert all(v < stop if step > 0 else v > stop for v in values)
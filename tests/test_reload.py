@@ -0,0 +1,76 @@
+import threading
+
+from qseq.csvlog import CsvLog
+from qseq.sequencer import Sequencer
+
+SEQUENCE = '''l {resource}
+s 0.4 log.append("a")
+s 0.4 log.append("b")
+s 0.4 log.append("c")
+s 0.4 log.append("d")
+'''
+
+
+def run_with_edit(tmp_path, edit, at=1.0):
+    """Runs the sequence with hot reload and applies edit(text) to the file
+    at the given time, returns the log of the steps."""
+    resource = tmp_path / 'steps.py'
+    resource.write_text('log = []\n')
+    filename = tmp_path / 'test.seq'
+    filename.write_text(SEQUENCE.format(resource=resource))
+
+    s = Sequencer(hot_reload=True, log=CsvLog(str(tmp_path / 'log.csv')))
+    s.reload_interval = 0.05
+    s.load_sequence_file(str(filename))
+
+    timer = threading.Timer(at, lambda: filename.write_text(
+        edit(filename.read_text())))
+    timer.start()
+    try:
+        s.start()
+    finally:
+        timer.cancel()
+    return s.environment.globals['log']
+
+
+def test_steps_which_ran_are_not_repeated(tmp_path):
+    # the inserted line moves b, which already ran at 0.8, to 1.2
+    log = run_with_edit(tmp_path, lambda text: text.replace(
+        's 0.4 log.append("a")',
+        's 0.4 log.append("x")\ns 0.4 log.append("a")'))
+    assert log.count('b') == 1
+    assert sorted(log) == ['a', 'b', 'c', 'd', 'x']
+
+
+def test_added_single_steps_start_at_the_reload(tmp_path):
+    log = run_with_edit(tmp_path, lambda text: text.replace(
+        's 0.4 log.append("a")',
+        's 0.4 log.append("x")\ns 0.4 log.append("a")'))
+    # x is scheduled at 0.4, before the reload, it runs right after it
+    assert log == ['a', 'b', 'x', 'c', 'd']
+
+
+def test_removed_steps_are_dropped(tmp_path):
+    log = run_with_edit(tmp_path, lambda text: text.replace(
+        's 0.4 log.append("c")\n', ''))
+    assert log == ['a', 'b', 'd']
+
+
+def test_steps_before_a_removed_step_are_not_lost(tmp_path):
+    # c moves to 0.8, which was the time of b, it still has to run
+    log = run_with_edit(tmp_path, lambda text: text.replace(
+        's 0.4 log.append("a")\n', ''))
+    assert log == ['a', 'b', 'c', 'd']
+
+
+def test_changing_the_delay_of_a_step_which_ran(tmp_path):
+    log = run_with_edit(tmp_path, lambda text: text.replace(
+        's 0.4 log.append("a")', 's 0.3 log.append("a")'))
+    assert log.count('a') == 1
+
+
+def test_delaying_a_step_which_ran(tmp_path):
+    # b ran at 0.8 and moves to 0.9, c and d follow it
+    log = run_with_edit(tmp_path, lambda text: text.replace(
+        's 0.4 log.append("b")', 's 0.5 log.append("b")'))
+    assert log == ['a', 'b', 'c', 'd']
@@ -0,0 +1,39 @@
+from qseq import sequencer
+from qseq.seqcache import SequenceCache
+from qseq.sequencer import Sequencer, SequenceFileParser
+
+
+def test_file_changed_while_parsing_is_not_cached(tmp_path, monkeypatch):
+    filename = tmp_path / 'test.seq'
+    filename.write_text('s 1 old()\n')
+    cache = SequenceCache(str(tmp_path / 'cache'))
+
+    class SavedWhileParsing(SequenceFileParser):
+        def parse_input(self):
+            SequenceFileParser.parse_input(self)
+            filename.write_text('s 2 new()\n')
+
+    monkeypatch.setattr(sequencer, 'SequenceFileParser', SavedWhileParsing)
+    s = Sequencer()
+    s.load_sequence_file(str(filename), cache)
+    assert [step.method for step in s.schedule] == ['old()']
+    monkeypatch.undo()
+
+    s = Sequencer()
+    s.load_sequence_file(str(filename), cache)
+    assert [step.method for step in s.schedule] == ['new()']
+
+
+def test_cached_schedule_is_reused(tmp_path):
+    filename = tmp_path / 'test.seq'
+    filename.write_text('s 1 a()\np 0.5 b()\n')
+    cache = SequenceCache(str(tmp_path / 'cache'))
+
+    s = Sequencer()
+    s.load_sequence_file(str(filename), cache, with_schedule=True)
+    expected = list(s.schedule)
+
+    s = Sequencer()
+    s.load_sequence_file(str(filename), cache)
+    assert s._schedule is not None
+    assert list(s.schedule) == expected
@@ -0,0 +1,39 @@
+import pytest
+
+from qseq.sequencer import Sequencer
+
+SEQUENCES = [
+    's 1 a()\ns 2 b()\n',
+    'p 0.3 a()\ns 1 b()\n',
+    'P 0.7 0.2 a()\ns 2 b()\np 1 c()\n',
+    'p 0.3 a()\ns 1 b()\nr 3\ns 0.5 c()\np 0.2 d()\nr 2\ns 0.1 e()\nR\nR\n'
+    'P 0.7 0.2 f()\ns 1 g()\n',
+    'r 4\np 0.25 a()\ns 1 b()\nR\n',
+    'r 0\ns 1 a()\nR\ns 1 b()\n',
+]
+
+
+@pytest.mark.parametrize('streaming', [False, True])
+@pytest.mark.parametrize('text', SEQUENCES)
+def test_step_count_matches_the_schedule(tmp_path, text, streaming):
+    filename = tmp_path / 'test.seq'
+    filename.write_text(text)
+    s = Sequencer(streaming=streaming)
+    s.load_sequence_file(str(filename))
+    assert s.step_count() == sum(1 for step in s.iter_schedule())
+
+
+@pytest.mark.parametrize('start', [-1.0, 0.0, 0.3, 1.0, 1.45, 2.6, 10.0])
+@pytest.mark.parametrize('text', SEQUENCES)
+def test_periodic_steps_start_at_the_given_time(tmp_path, text, start):
+    filename = tmp_path / 'test.seq'
+    filename.write_text(text)
+    s = Sequencer()
+    s.load_sequence_file(str(filename))
+
+    def after_start(steps):
+        return [step for step in steps
+                if step[1] not in s._periods or step[0] > start]
+
+    assert after_start(s._block_steps(s._root, 0.0, start)) == \
+        after_start(s._iter_steps())